@@ -0,0 +1,156 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+
+# Control de admisión para las llamadas a OpenAI.
+# - máximo N llamadas en vuelo y un presupuesto de tokens por minuto (cubeta que se rellena)
+# - quien no cabe espera en una cola acotada ordenada por prioridad (las citas primero)
+# - si la cola está llena o la espera pasa del límite: Saturado (el bot contesta una plantilla)
+# - un 429 de OpenAI se reintenta con backoff exponencial y jitter (nunca antes de su Retry-After
+#   ni después de la espera máxima); el cliente de OpenAI debe llamarse con max_retries=0
+
+PRIORIDAD_CIERRE = 0   # conversaciones agendando visita
+PRIORIDAD_NORMAL = 1
+
+class Saturado(Exception):
+    """No hubo lugar para la llamada (cola llena o espera agotada)"""
+
+def _es_rate_limit(e):
+    try:
+        from openai import RateLimitError
+        if isinstance(e, RateLimitError): return True
+    except ImportError:
+        pass
+    return getattr(e, 'status_code', None) == 429
+
+def _retry_after(e):
+    """Segundos que pide OpenAI en el header Retry-After (si viene)"""
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except Exception:
+        return None
+
+class ControlAdmision:
+    def __init__(self, max_concurrentes=16, tokens_por_minuto=200000, max_cola=100, espera_maxima=10.0,
+                 reintentos=3, espera_base=0.5):
+        self.max_concurrentes = max_concurrentes
+        self.capacidad = tokens_por_minuto
+        self.max_cola = max_cola
+        self.espera_maxima = espera_maxima
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._cond = threading.Condition()
+        self._espera = []                    # heap de (prioridad, turno)
+        self._expulsados = set()             # lugares que una cita sacó de la cola
+        self._turnos = itertools.count()
+        self._tokens = float(tokens_por_minuto)
+        self._rellenado = time.monotonic()
+        self.en_vuelo = 0
+        self.admitidos = 0
+        self.descartados = 0
+        self.reintentos_429 = 0
+        self.fallidos_429 = 0
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._rellenado) * self.capacidad / 60)
+        self._rellenado = ahora
+
+    def _cabe(self, tokens):
+        # Un prompt más grande que la cubeta entra cuando está llena (si no, nunca entraría)
+        return self.en_vuelo < self.max_concurrentes and self._tokens >= min(tokens, self.capacidad)
+
+    def _adquirir(self, tokens, prioridad, espera_maxima):
+        with self._cond:
+            self._rellenar()
+            if not self._espera and self._cabe(tokens):
+                return self._tomar(tokens)
+            lugar = (prioridad, next(self._turnos))
+            if len(self._espera) >= self.max_cola:
+                # Cola llena: una cita saca al último turno normal en vez de quedarse fuera
+                peor = max(self._espera)
+                if peor[0] <= prioridad:
+                    self.descartados += 1
+                    raise Saturado("cola de LLM llena")
+                self._espera.remove(peor)
+                heapq.heapify(self._espera)
+                self._expulsados.add(peor)
+            heapq.heappush(self._espera, lugar)
+            limite = time.monotonic() + espera_maxima
+            try:
+                while True:
+                    if lugar in self._expulsados:
+                        self._expulsados.discard(lugar)
+                        self.descartados += 1
+                        raise Saturado("cola de LLM llena")
+                    self._rellenar()
+                    if self._espera[0] == lugar and self._cabe(tokens):
+                        heapq.heappop(self._espera)
+                        return self._tomar(tokens)
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._espera.remove(lugar)
+                        heapq.heapify(self._espera)
+                        self.descartados += 1
+                        raise Saturado("espera de LLM agotada")
+                    # Si sólo faltan tokens, despertamos cuando alcancen; si falta lugar, al liberar
+                    faltan = min(tokens, self.capacidad) - self._tokens
+                    self._cond.wait(min(restante, max(0.01, faltan * 60 / self.capacidad)) if faltan > 0 else restante)
+            finally:
+                self._cond.notify_all()  # el siguiente de la cola revisa si ya le toca
+
+    def _tomar(self, tokens):
+        self._tokens -= tokens
+        self.en_vuelo += 1
+        self.admitidos += 1
+
+    def _liberar(self, estimados, reales):
+        with self._cond:
+            self.en_vuelo -= 1
+            if reales is not None:
+                self._tokens -= reales - estimados  # se cobra lo que de verdad se gastó
+            self._cond.notify_all()
+
+    def llamar(self, funcion, tokens_estimados, prioridad=PRIORIDAD_NORMAL, tokens_reales=None, espera_maxima=None):
+        """funcion() con admisión; tokens_reales(resultado) -> int ajusta la cubeta. Lanza Saturado.
+        espera_maxima acota la espera de este turno (lo que le queda de su plazo) sin pasar la del control."""
+        espera = self.espera_maxima if espera_maxima is None else min(self.espera_maxima, espera_maxima)
+        limite = time.monotonic() + espera  # la cola y los reintentos por 429 salen del mismo presupuesto
+        self._adquirir(tokens_estimados, prioridad, espera)
+        reales = None
+        try:
+            intento = 0
+            while True:
+                try:
+                    resultado = funcion()
+                    if tokens_reales: reales = tokens_reales(resultado)
+                    return resultado
+                except Exception as e:
+                    if not _es_rate_limit(e): raise
+                    intento += 1
+                    pausa = self.espera_base * (2 ** (intento - 1)) * random.uniform(0.5, 1.5)
+                    pausa = max(pausa, _retry_after(e) or 0)  # el Retry-After es un mínimo
+                    if intento > self.reintentos or time.monotonic() + pausa > limite:
+                        with self._cond:
+                            self.fallidos_429 += 1
+                        raise
+                    with self._cond:
+                        self.reintentos_429 += 1
+                    time.sleep(pausa)
+        finally:
+            self._liberar(tokens_estimados, reales)
+
+    def estadisticas(self):
+        with self._cond:
+            self._rellenar()
+            return {
+                "en_cola": len(self._espera),
+                "en_vuelo": self.en_vuelo,
+                "tokens_disponibles": int(self._tokens),
+                "admitidos": self.admitidos,
+                "descartados": self.descartados,
+                "reintentos_429": self.reintentos_429,
+                "fallidos_429": self.fallidos_429,
+            }
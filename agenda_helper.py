@@ -1,84 +1,210 @@
 import os
 import datetime
+import threading
+import httplib2
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from dateutil import parser
 import pytz
+from cache_local import CacheLRU
+from disponibilidad import Horario, calcular_huecos, texto_huecos
+from metricas import metricas
 
 # Configuración
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 ARCHIVO_KEY = 'google_key.json'
 
+class ClienteCalendar:
+    """Conexión reutilizable a Google Calendar.
+    Las credenciales se cargan una vez y el token sólo se renueva cerca de expirar.
+    Cada hilo tiene su propio servicio (httplib2 no es thread-safe) con conexión HTTP persistente.
+    crear_http permite inyectar otro transporte (ej. un httplib2 falso o HttpMock para pruebas)."""
+
+    def __init__(self, archivo_key=ARCHIVO_KEY, scopes=SCOPES, credenciales=None, crear_http=None,
+                 margen_refresco=300, timeout=10):
+        self.archivo_key = archivo_key
+        self.scopes = scopes
+        self.margen_refresco = datetime.timedelta(seconds=margen_refresco)
+        self.crear_http = crear_http or (lambda: httplib2.Http(timeout=timeout))
+        self._creds = credenciales
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _credenciales(self):
+        if self._creds is None:
+            with self._lock:
+                if self._creds is None:
+                    self._creds = service_account.Credentials.from_service_account_file(
+                        self.archivo_key, scopes=self.scopes
+                    )
+        return self._creds
+
+    def _por_expirar(self, creds):
+        if not getattr(creds, 'token', None): return True
+        expira = getattr(creds, 'expiry', None)
+        if expira is None: return False
+        ahora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)  # google-auth usa UTC naive
+        return expira - ahora < self.margen_refresco
+
+    def _refrescar_si_hace_falta(self):
+        creds = self._credenciales()
+        if not hasattr(creds, 'refresh') or not self._por_expirar(creds): return
+        with self._lock:
+            # Un solo hilo renueva; los demás ven el token nuevo al soltar el lock
+            if self._por_expirar(creds):
+                creds.refresh(google_auth_httplib2.Request(self.crear_http()))
+
+    def servicio(self):
+        self._refrescar_si_hace_falta()
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            http = google_auth_httplib2.AuthorizedHttp(self._credenciales(), http=self.crear_http())
+            # static_discovery: usa el documento incluido en la librería, sin ir a la red
+            service = build('calendar', 'v3', http=http, static_discovery=True, cache_discovery=False)
+            self._local.service = service
+        return service
+
+_cliente = None
+_cliente_lock = threading.Lock()
+
+def obtener_cliente():
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                _cliente = ClienteCalendar()
+    return _cliente
+
+def configurar_cliente(cliente):
+    """Reemplaza el cliente global (para apuntar a un transporte falso o a otra llave)"""
+    global _cliente
+    with _cliente_lock:
+        _cliente = cliente
+
 def conectar_calendar():
-    creds = service_account.Credentials.from_service_account_file(
-        ARCHIVO_KEY, scopes=SCOPES
-    )
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+    return obtener_cliente().servicio()
 
-def obtener_huecos_libres(calendario_id):
-    """Revisa los próximos 5 días y busca espacios libres en horario laboral (9am-6pm)"""
+# --- DISPONIBILIDAD ---
+ZONA = 'America/Mexico_City'
+AGENDA_DIAS = int(os.getenv("AGENDA_DIAS", "5"))
+HORARIO = Horario(
+    hora_inicio=int(os.getenv("AGENDA_HORA_INICIO", "9")),
+    hora_fin=int(os.getenv("AGENDA_HORA_FIN", "18")),
+    duracion_min=int(os.getenv("AGENDA_DURACION_MIN", "60")),
+    buffer_min=int(os.getenv("AGENDA_BUFFER_MIN", "15")),
+)
+# Ocupado por calendario; TTL corto porque el agente también agenda a mano
+cache_ocupado = CacheLRU(max_items=1000, ttl=int(os.getenv("AGENDA_CACHE_TTL", "60")))
+MAX_CALENDARIOS_FREEBUSY = 50  # límite de Google por consulta
+
+def _consultar_freebusy(calendarios, desde, hasta):
+    """Una sola llamada freebusy para varios calendarios -> {calendario: [(inicio, fin)]}"""
     service = conectar_calendar()
-    zona_horaria = pytz.timezone('America/Mexico_City') # Ajusta a tu zona
-    
-    ahora = datetime.datetime.now(zona_horaria)
-    inicio_semana = ahora.isoformat()
-    fin_semana = (ahora + datetime.timedelta(days=5)).isoformat()
-    
-    # 1. Preguntar a Google: ¿Cuándo está OCUPADO este agente?
-    eventos_result = service.events().list(
-        calendarId=calendario_id, 
-        timeMin=inicio_semana,
-        timeMax=fin_semana,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    eventos = eventos_result.get('items', [])
-
-    # 2. Calcular huecos libres
-    agenda_texto = "📅 *Horarios Disponibles esta semana:*\n"
-    dias_revisados = 0
-    
-    # Revisamos día por día (Próximos 3 días para no saturar texto)
-    for i in range(3): 
-        dia_revision = ahora + datetime.timedelta(days=i)
-        dia_str = dia_revision.strftime("%Y-%m-%d")
-        dia_nombre = dia_revision.strftime("%A") # Ej: Monday
-        
-        # Horario laboral: 9:00 AM a 6:00 PM
-        hora_inicio = dia_revision.replace(hour=9, minute=0, second=0, microsecond=0)
-        hora_fin = dia_revision.replace(hour=18, minute=0, second=0, microsecond=0)
-        
-        # Filtramos eventos de ESE día
-        ocupado = []
-        for e in eventos:
-            inicio_e = parser.parse(e['start'].get('dateTime', e['start'].get('date')))
-            if inicio_e.date() == dia_revision.date():
-                ocupado.append(inicio_e)
-        
-        # Lógica simplificada: Si tiene menos de 3 eventos, decimos que tiene espacio
-        # (Para un algoritmo exacto de huecos minuto a minuto se requiere más código, 
-        #  por ahora usaremos una lógica conversacional).
-        
-        if len(ocupado) == 0:
-            agenda_texto += f"- {dia_nombre}: ✅ Todo el día libre (9am - 6pm)\n"
-        elif len(ocupado) > 4:
-            agenda_texto += f"- {dia_nombre}: 🔴 Día muy lleno\n"
-        else:
-            agenda_texto += f"- {dia_nombre}: ⚠️ Quedan espacios (tiene {len(ocupado)} citas)\n"
-            
-    return agenda_texto
-
-def crear_evento(calendario_id, nombre_cliente, fecha_hora_str):
-    """Crea la cita real en el calendario"""
+    with metricas.span("calendar_freebusy"):
+        resultado = service.freebusy().query(body={
+            "timeMin": desde.isoformat(),
+            "timeMax": hasta.isoformat(),
+            "timeZone": ZONA,
+            "items": [{"id": c} for c in calendarios],
+        }).execute()
+    ocupado = {}
+    for cal in calendarios:
+        info = resultado.get('calendars', {}).get(cal, {})
+        if info.get('errors'):
+            # Normalmente: el calendario no está compartido con la cuenta de servicio
+            metricas.error("calendar_freebusy", f"{cal}: {info['errors']}")
+            continue
+        ocupado[cal] = [(parser.isoparse(b['start']), parser.isoparse(b['end'])) for b in info.get('busy', [])]
+    return ocupado
+
+# Calendarios que fallaron (no compartidos con la cuenta de servicio, error de Google): no se
+# vuelven a consultar en cada turno, sólo cuando vence este TTL corto
+cache_fallos_calendario = CacheLRU(max_items=1000, ttl=int(os.getenv("AGENDA_CACHE_ERROR_TTL", "30")))
+ESPERA_CONSULTA_AJENA = 15  # segundos que un turno espera la consulta que ya hizo otro hilo
+
+class _Consulta:
+    """Una consulta freebusy en curso para un calendario (single-flight)"""
+    __slots__ = ("lista", "ocupado")
+
+    def __init__(self):
+        self.lista = threading.Event()
+        self.ocupado = None
+
+_en_vuelo = {}  # calendario -> _Consulta
+_en_vuelo_lock = threading.Lock()
+
+def obtener_ocupado(calendarios):
+    """Intervalos ocupados por calendario; lo que no está en cache se pide en lotes de freebusy.
+    Si otro hilo ya está consultando un calendario se espera su resultado en vez de repetir la llamada."""
+    resultado, faltan = {}, []
+    for cal in calendarios:
+        ocupado = cache_ocupado.buscar(cal)
+        if ocupado is not None: resultado[cal] = ocupado
+        elif cache_fallos_calendario.buscar(cal) is None: faltan.append(cal)
+    mias, ajenas = {}, {}
+    with _en_vuelo_lock:
+        for cal in faltan:
+            if cal in _en_vuelo:
+                ajenas[cal] = _en_vuelo[cal]
+            else:
+                mias[cal] = _en_vuelo[cal] = _Consulta()
+    try:
+        if mias:
+            ahora = datetime.datetime.now(pytz.timezone(ZONA))
+            hasta = ahora + datetime.timedelta(days=AGENDA_DIAS)
+            pendientes = list(mias)
+            for i in range(0, len(pendientes), MAX_CALENDARIOS_FREEBUSY):
+                lote = pendientes[i:i + MAX_CALENDARIOS_FREEBUSY]
+                try:
+                    nuevos = _consultar_freebusy(lote, ahora, hasta)
+                except Exception:
+                    for cal in lote: cache_fallos_calendario.guardar(cal, True)
+                    raise
+                for cal in lote:
+                    if cal not in nuevos:
+                        cache_fallos_calendario.guardar(cal, True)
+                        continue
+                    cache_ocupado.guardar(cal, nuevos[cal])
+                    resultado[cal] = mias[cal].ocupado = nuevos[cal]
+    finally:
+        with _en_vuelo_lock:
+            for cal, consulta in mias.items():
+                _en_vuelo.pop(cal, None)
+                consulta.lista.set()
+    for cal, consulta in ajenas.items():
+        if consulta.lista.wait(ESPERA_CONSULTA_AJENA) and consulta.ocupado is not None:
+            resultado[cal] = consulta.ocupado
+    return resultado
+
+def obtener_disponibilidad(calendarios):
+    """Huecos libres concretos por calendario -> {calendario: [(inicio, fin)]}"""
+    ahora = datetime.datetime.now(pytz.timezone(ZONA))
+    return {
+        cal: calcular_huecos(ocupado, ahora, AGENDA_DIAS, HORARIO)
+        for cal, ocupado in obtener_ocupado(calendarios).items()
+    }
+
+def obtener_huecos_libres(calendario_id):
+    """Horarios libres concretos de los próximos días, en texto para el prompt"""
+    disponibilidad = obtener_disponibilidad([calendario_id])
+    if calendario_id not in disponibilidad:
+        raise RuntimeError(f"No se pudo leer el calendario {calendario_id}")
+    return texto_huecos(disponibilidad[calendario_id])
+
+def crear_evento(calendario_id, nombre_cliente, fecha_hora_str, id_evento=None):
+    """Crea la cita real en el calendario.
+    id_evento (base32hex: 0-9 a-v, 5 a 1024 caracteres) hace el alta idempotente: si la misma cita
+    se vuelve a mandar, Google responde 409 en vez de crear un evento duplicado."""
     # fecha_hora_str debe ser formato: "2024-01-20 16:00"
     service = conectar_calendar()
     
     # Convertimos texto a objeto fecha
     fecha_dt = parser.parse(fecha_hora_str) 
     
-    # Duración cita: 1 hora
-    fin_dt = fecha_dt + datetime.timedelta(hours=1)
+    # Misma duración que los huecos que se le ofrecieron al cliente (AGENDA_DURACION_MIN)
+    fin_dt = fecha_dt + HORARIO.duracion
     
     evento = {
         'summary': f'Visita: {nombre_cliente}',
@@ -94,5 +220,17 @@ def crear_evento(calendario_id, nombre_cliente, fecha_hora_str):
         },
     }
 
-    event = service.events().insert(calendarId=calendario_id, body=evento).execute()
-    return event.get('htmlLink')
\ No newline at end of file
+    if id_evento:
+        evento['id'] = id_evento
+
+    try:
+        with metricas.span("calendar_insert"):
+            event = service.events().insert(calendarId=calendario_id, body=evento).execute()
+    except HttpError as e:
+        if not id_evento or e.resp.status != 409: raise
+        event = {}  # ya existía: un reintento de la misma cita, no se duplica
+
+    # Parchamos la cache para no volver a ofrecer ese horario
+    inicio = fecha_dt if fecha_dt.tzinfo else pytz.timezone(ZONA).localize(fecha_dt)
+    cache_ocupado.modificar(calendario_id, lambda ocupado: ocupado + [(inicio, inicio + HORARIO.duracion)])
+    return event.get('htmlLink')
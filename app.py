@@ -1,15 +1,32 @@
 import os
+import re
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime
 import pytz 
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify, send_file, abort
 from twilio.twiml.messaging_response import MessagingResponse
 from openai import OpenAI
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
 # Tu módulo de calendario
-from agenda_helper import obtener_huecos_libres, crear_evento 
+from agenda_helper import obtener_huecos_libres, obtener_ocupado, crear_evento, cache_ocupado
+from cache_local import CacheLRU, AvisosInvalidacion
+from prompt_bot import construir_mensajes_sistema, cache_prompts, prefijo_estatico
+from conversaciones import crear_almacen, estimar_tokens
+from cola_webhook import ColaMensajes, EnviadorTwilio, EnviadorFalso
+from inquilinos import IndiceInquilinos
+from cola_escrituras import EscrituraDiferida
+from router_intenciones import RouterIntenciones
+from cache_respuestas import CacheRespuestas, normalizar
+from metricas import metricas
+from secuenciador import Secuenciador
+from medios import AlmacenMedios
+from admision_llm import ControlAdmision, Saturado, PRIORIDAD_CIERRE, PRIORIDAD_NORMAL
 
 load_dotenv('test.env')
 
@@ -22,137 +39,340 @@ supabase: Client = create_client(url_supabase, key_supabase)
 
 # --- CONFIGURACIÓN OPENAI ---
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-historial_conversaciones = {}
+# Las llamadas del bot pasan por admision_llm, que ya reintenta los 429: el SDK no debe reintentar encima
+cliente_llm = client.with_options(max_retries=0)
+# Historial acotado (memoria o SQLite compartido, ver conversaciones.py)
+conversaciones = crear_almacen()
+
+# --- CACHE (agentes e inventario cambian pocas veces al día) ---
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_AGENTES = int(os.getenv("CACHE_MAX_AGENTES", "500"))
+CACHE_TOKEN = os.getenv("CACHE_TOKEN")
+cache_agentes = CacheLRU(max_items=CACHE_MAX_AGENTES, ttl=CACHE_TTL)
+cache_inventario = CacheLRU(max_items=CACHE_MAX_AGENTES, ttl=CACHE_TTL)
+# Último inventario bueno de cada agente (sobrevive a la invalidación): respaldo si Supabase tarda
+respaldo_inventario = CacheLRU(max_items=CACHE_MAX_AGENTES, ttl=24 * 3600)
+# Con varios workers: la invalidación que le llega a uno se reparte a los demás (opcional)
+avisos = AvisosInvalidacion(os.getenv("INVALIDACIONES_DB")) if os.getenv("INVALIDACIONES_DB") else None
+
+def invalidar_cache(id_agente=None):
+    """Tira lo cacheado de un agente (o de todos si no se indica)"""
+    inquilinos.marcar_vencido()  # pudo cambiar teléfono o suscripción
+    if id_agente is None:
+        cache_agentes.limpiar()
+        cache_inventario.limpiar()
+    else:
+        cache_agentes.invalidar(int(id_agente))
+        cache_inventario.invalidar(int(id_agente))
 
 # --- DATOS ---
-def obtener_datos_agente(id_agente=1):
+def _cargar_agente_db(id_agente):
     response = supabase.table('agentes').select("*").eq('id', id_agente).execute()
     return response.data[0] if response.data else None
 
-def obtener_propiedades_db(id_agente=1):
+def _cargar_inventario_db(id_agente):
     response = supabase.table('propiedades').select("*").eq('agente_id', id_agente).execute()
-    return response.data
+    propiedades = response.data or []
+    for p in propiedades:
+        precalentar_foto(p.get('foto_url'))  # las que falten se bajan en segundo plano
+    # La versión es un hash del contenido: si nada cambió, la versión tampoco
+    firma = json.dumps(propiedades, sort_keys=True, default=str).encode()
+    inventario = {"version": hashlib.sha1(firma).hexdigest()[:12], "propiedades": propiedades}
+    respaldo_inventario.guardar(id_agente, inventario)
+    return inventario
+
+def _cargar_inquilinos_db():
+    return supabase.table('agentes').select("id, telefono, suscripcion_fin, rol").execute().data
+
+# Número del bot (To de Twilio) -> agente; se recarga cada 5 min o cuando el dashboard avisa
+# (se carga en precalentar() o con el primer mensaje)
+inquilinos = IndiceInquilinos(_cargar_inquilinos_db, ttl_refresco=int(os.getenv("INQUILINOS_TTL", "300")))
+# Para instalaciones de un solo agente que aún no registran el número del bot
+AGENTE_POR_DEFECTO = os.getenv("AGENTE_POR_DEFECTO")
+
+def resolver_agente(numero_bot):
+    """(agente_id, activo) para el número que recibió el mensaje"""
+    agente_id, activo = inquilinos.resolver(numero_bot)
+    if agente_id is None and AGENTE_POR_DEFECTO:
+        return int(AGENTE_POR_DEFECTO), True
+    return agente_id, activo
+
+def obtener_datos_agente(id_agente=1):
+    return cache_agentes.obtener(id_agente, lambda: _cargar_agente_db(id_agente))
+
+def obtener_inventario(id_agente=1):
+    return cache_inventario.obtener(id_agente, lambda: _cargar_inventario_db(id_agente))
+
+def obtener_propiedades_db(id_agente=1):
+    return obtener_inventario(id_agente)["propiedades"]
 
-def guardar_lead_completo(nombre, telefono, edad, perfil, mensaje_cita):
+# --- ESCRITURAS DIFERIDAS (leads y citas) ---
+# El webhook sólo paga un INSERT local; un hilo de fondo las manda a Supabase/Calendar
+escrituras = EscrituraDiferida(os.getenv("ESCRITURAS_DB", "escrituras.db"))
+
+def _insertar_leads(filas):
+    supabase.table('clientes').insert(filas).execute()
+    print(f"✅ {len(filas)} lead(s) guardado(s)")
+
+def _crear_citas(citas):
+    for c in citas:
+        crear_evento(c['calendario'], c['nombre'], c['fecha_hora'], c.get('id_evento'))
+
+escrituras.registrar("lead", _insertar_leads, lote=50)
+escrituras.registrar("cita", _crear_citas, lote=1)  # una por una: un evento no se puede "reintentar a medias"
+
+def clave_cita(agente_id, telefono, fecha_hora):
+    """Misma cita (agente, cliente, horario) = misma clave, aunque AGENDA_CITA se procese dos veces"""
+    return hashlib.sha1(f"{agente_id}|{telefono}|{fecha_hora.strip()}".encode()).hexdigest()
+
+def guardar_lead_completo(agente_id, nombre, telefono, edad, perfil, mensaje_cita, clave=None):
     datos = {
-        "agente_id": 1, 
+        "agente_id": agente_id, 
         "nombre": nombre, 
         "telefono": telefono, 
         "edad": edad,
         "perfil_vida": perfil,
         "interes_principal": mensaje_cita
     }
-    supabase.table('clientes').insert(datos).execute()
-    print(f"✅ Lead Guardado: {nombre}")
+    if escrituras.encolar("lead", datos, f"lead:{clave or hashlib.sha1(json.dumps(datos).encode()).hexdigest()}"):
+        print(f"📝 Lead en cola: {nombre}")
+
+# --- ETAPAS PREVIAS AL LLM ---
+# Agente e inventario (casi siempre en memoria) van en su pool; el calendario, que puede tardar
+# segundos, va en otro pool acotado: un Google lento sólo deja sin agenda, nunca sin agente.
+# Cada etapa tiene su tiempo límite y su valor de respaldo.
+TEXTO_SIN_AGENDA = "No hay calendario conectado."
+INVENTARIO_VACIO = {"version": "vacio", "propiedades": []}
+ETAPA_TIMEOUT_DB = float(os.getenv("ETAPA_TIMEOUT_DB", "3"))
+ETAPA_TIMEOUT_AGENDA = float(os.getenv("ETAPA_TIMEOUT_AGENDA", "4"))
+pool_etapas = ThreadPoolExecutor(max_workers=int(os.getenv("ETAPAS_WORKERS", "32")), thread_name_prefix="etapa")
+pool_agenda = ThreadPoolExecutor(max_workers=int(os.getenv("AGENDA_WORKERS", "16")), thread_name_prefix="agenda")
+
+class _Respaldo(Exception):
+    """La etapa no llegó a tiempo (o falló) y se usó su valor de respaldo"""
+
+def _esperar_etapa(futuro, limite, etapa):
+    try:
+        return futuro.result(timeout=max(0, limite - time.monotonic()))
+    except FuturesTimeout:
+        futuro.cancel()  # si ni siquiera empezó, que no ocupe un hilo después
+        metricas.contar("etapa_timeouts_total", 1, "Etapas que excedieron su tiempo", etapa=etapa)
+        print(f"⏱️ Etapa '{etapa}' excedió su tiempo, usamos respaldo")
+    except Exception as e:
+        metricas.error(etapa, e)
+    raise _Respaldo(etapa)
+
+def preparar_contexto(id_agente, limite=None):
+    """(agente, inventario, texto_agenda, completo); la espera total es la de la etapa más lenta, no la suma.
+    completo=False si alguna etapa usó su respaldo (la respuesta no se debe cachear).
+    limite: momento (monotonic) en que hay que dejar de esperar aunque la etapa tenga más tiempo."""
+    inicio = time.monotonic()
+    tope = (lambda t: min(t, limite)) if limite is not None else (lambda t: t)
+    f_agente = pool_etapas.submit(metricas.medido("agente", obtener_datos_agente), id_agente)
+    f_inventario = pool_etapas.submit(metricas.medido("inventario", obtener_inventario), id_agente)
+    completo = True
+
+    try:
+        agente = _esperar_etapa(f_agente, tope(inicio + ETAPA_TIMEOUT_DB), "agente")
+    except _Respaldo:
+        agente, completo = None, False
+    # La agenda sólo necesita el calendar_email; se lanza en cuanto lo tenemos
+    f_agenda = None
+    if agente and agente.get('calendar_email'):
+        f_agenda = pool_agenda.submit(metricas.medido("agenda", obtener_huecos_libres), agente['calendar_email'])
+    try:
+        inventario = _esperar_etapa(f_inventario, tope(inicio + ETAPA_TIMEOUT_DB), "inventario")
+    except _Respaldo:
+        inventario, completo = respaldo_inventario.buscar(id_agente) or INVENTARIO_VACIO, False
+    texto_agenda = TEXTO_SIN_AGENDA
+    if f_agenda is not None:
+        try:
+            texto_agenda = _esperar_etapa(f_agenda, tope(inicio + ETAPA_TIMEOUT_AGENDA), "agenda")
+        except _Respaldo:
+            completo = False
+    return agente, inventario, texto_agenda, completo
+
+# --- ROUTER DE INTENCIONES ---
+ROUTER_ACTIVO = os.getenv("ROUTER_ACTIVO", "1") == "1"
+router = RouterIntenciones()
+
+# --- CACHE DE RESPUESTAS ---
+cache_respuestas = CacheRespuestas(
+    max_items=int(os.getenv("CACHE_RESPUESTAS_MAX", "2000")),
+    ttl=int(os.getenv("CACHE_RESPUESTAS_TTL", str(24 * 3600))),
+    ruta_sqlite=os.getenv("CACHE_RESPUESTAS_DB"),  # opcional: compartida entre workers
+    max_filas=int(os.getenv("CACHE_RESPUESTAS_MAX_DB", "20000")),
+)
+
+# --- ADMISIÓN A OPENAI (picos de campaña: concurrencia, tokens/min y prioridad a las citas) ---
+# Los límites son de la cuenta de OpenAI; con varios workers (LLM_PROCESOS, lo pone gunicorn.conf.py)
+# cada proceso se queda con su parte para que la suma no pase del límite real
+PROCESOS_LLM = max(1, int(os.getenv("LLM_PROCESOS", "1")))
+admision_llm = ControlAdmision(
+    max_concurrentes=max(1, int(os.getenv("LLM_MAX_CONCURRENTES", "16")) // PROCESOS_LLM),
+    tokens_por_minuto=max(1, int(os.getenv("LLM_TOKENS_POR_MINUTO", "200000")) // PROCESOS_LLM),
+    max_cola=int(os.getenv("LLM_MAX_COLA", "100")),
+    espera_maxima=float(os.getenv("LLM_ESPERA_MAXIMA", "10")),  # en modo síncrono Twilio corta a los 15 s
+    reintentos=int(os.getenv("LLM_REINTENTOS_429", "3")),
+)
+TOKENS_SALIDA_ESTIMADOS = 300
+# Modo síncrono: un solo plazo por turno desde que llega el webhook (Twilio corta a los 15 s y reintenta).
+# Ráfaga, turno anterior, etapas y cola del LLM salen de ese plazo; RESERVA_LLM queda para la llamada.
+PLAZO_TURNO = float(os.getenv("BOT_PLAZO_TURNO", "13"))
+RESERVA_LLM = float(os.getenv("LLM_RESERVA_SEG", "4"))
+TEXTO_SATURADO = ("¡Gracias por escribirme! 🙏 En este momento tengo muchísimas consultas; "
+                  "dame un par de minutos y te respondo con calma. ✨")
+
+# Sólo señales de que ya se están pidiendo los datos de la cita (la REGLA DE ORO del prompt) o se confirmó;
+# "visita"/"agendar" salen en cualquier ficha y harían que toda plática de catálogo se saltara la cola
+MARCAS_CIERRE = re.compile(r"agenda_cita|\bnombre completo\b|\bregistrar tu visita\b")
+
+def prioridad_turno(historial):
+    """Las pláticas que ya van en la cita (CIERRE) pasan primero"""
+    recientes = " ".join(normalizar(m['content']) for m in historial[-4:])
+    return PRIORIDAD_CIERRE if MARCAS_CIERRE.search(recientes) else PRIORIDAD_NORMAL
+
+# --- MEDIOS: fotos reducidas y servidas por nosotros (ver medios.py) ---
+MEDIA_URL_BASE = (os.getenv("MEDIA_URL_BASE") or "").rstrip("/")  # URL pública del bot; vacío = se manda el original
+medios = AlmacenMedios(os.getenv("MEDIOS_DIR", "medios"))
+
+def precalentar_foto(url):
+    if MEDIA_URL_BASE and url:
+        medios.precalentar(url)
+
+def fotos_del_agente(agente_id):
+    """Las únicas URLs que el bot manda o descarga: las foto_url del inventario de ese agente"""
+    return {p['foto_url'] for p in obtener_propiedades_db(agente_id) if p.get('foto_url')}
+
+def url_para_whatsapp(url, agente_id):
+    """La copia local si ya está lista; si no, el original (y se prepara para la próxima).
+    Una URL que no es del inventario (ej. inventada por el LLM) no se manda ni se descarga."""
+    if not url: return None
+    if url not in fotos_del_agente(agente_id):
+        metricas.contar("medios_rechazados_total", 1, "URLs de foto que no son del inventario", agente=agente_id)
+        return None
+    if not MEDIA_URL_BASE: return url
+    h = medios.hash_de_url(url)
+    if h: return f"{MEDIA_URL_BASE}/media/{h}.jpg"
+    medios.precalentar(url)
+    return url
 
 # --- BOT ---
-@app.route('/bot', methods=['POST'])
-def bot():
-    mensaje_usuario = request.values.get('Body', '')
-    numero_usuario = request.values.get('From', '')
-    
-    if numero_usuario not in historial_conversaciones:
-        historial_conversaciones[numero_usuario] = []
-    
-    historial_conversaciones[numero_usuario].append({"role": "user", "content": mensaje_usuario})
+def procesar_mensaje(numero_usuario, mensaje_usuario, numero_bot=None, limite=None):
+    """Todo el trabajo de un turno; regresa (texto, url_media) para mandarlo por TwiML o por la API.
+    Si el número no es de un agente activo regresa (None, None) y no se contesta.
+    limite: time.monotonic() en que la respuesta ya no sirve (None = sin plazo, modo asíncrono)."""
+    with metricas.span("turno"):
+        return _procesar_mensaje(numero_usuario, mensaje_usuario, numero_bot, limite)
+
+def _agregar_mensaje_cliente(clave_conversacion, texto):
+    """Agrega el mensaje del cliente y regresa el historial. Idempotente: si el último turno es este mismo
+    mensaje sin respuesta (reintento de la cola, o la ráfaga que se volvió a juntar), no se repite;
+    si el reintento trae mensajes nuevos detrás, sólo se agregan esos."""
+    historial = conversaciones.historial(clave_conversacion)
+    if historial and historial[-1]['role'] == 'user':
+        previo = historial[-1]['content']
+        if texto == previo:
+            return historial
+        if texto.startswith(previo + secuenciador.separador):
+            texto = texto[len(previo) + len(secuenciador.separador):]
+    conversaciones.agregar(clave_conversacion, "user", texto)
+    return conversaciones.historial(clave_conversacion)
+
+def _procesar_mensaje(numero_usuario, mensaje_usuario, numero_bot, limite):
+    inicio = time.perf_counter()
+    agente_id, activo = resolver_agente(numero_bot)
+    if agente_id is None or not activo:
+        return None, None
 
-    # 1. Preparar Datos
-    agente = obtener_datos_agente(1) 
-    propiedades = obtener_propiedades_db(1)
+    # Cada agente tiene sus propias pláticas aunque el cliente escriba a dos agentes
+    clave_conversacion = f"{agente_id}:{numero_usuario}"
+    historial = _agregar_mensaje_cliente(clave_conversacion, mensaje_usuario)
+
+    # 0. Atajo sin LLM (saludo, vitrina, detalle, foto) con el inventario cacheado
+    if ROUTER_ACTIVO:
+        try:
+            with metricas.span("router"):
+                atajo = router.responder(mensaje_usuario, historial, obtener_inventario(agente_id), inicio)
+        except Exception as e:
+            metricas.error("router", e)
+            atajo = None
+        if atajo:
+            _, texto_atajo, url_atajo = atajo
+            # Se guarda como lo hubiera escrito el LLM, para que la plática siga con contexto
+            conversaciones.agregar(clave_conversacion, "assistant",
+                                   texto_atajo + (f" FOTO:{url_atajo}" if url_atajo else ""))
+            return texto_atajo, url_para_whatsapp(url_atajo, agente_id)
+
+    # 1. Preparar Datos (agente, inventario y agenda en paralelo)
+    agente, inventario, texto_agenda, completo = preparar_contexto(agente_id, None if limite is None else limite - RESERVA_LLM)
+    if agente is None:
+        return "Dame un segundo, estoy revisando el sistema... 🤖", None
     
     # 2. Contexto Temporal
     zona_mx = pytz.timezone('America/Mexico_City')
     ahora = datetime.now(zona_mx)
-    fecha_hoy_str = ahora.strftime("%Y-%m-%d") 
-    dia_semana_str = ahora.strftime("%A")
 
-    # 3. Agenda
-    texto_agenda = "No hay calendario conectado."
-    if agente.get('calendar_email'):
-        try:
-            texto_agenda = obtener_huecos_libres(agente['calendar_email'])
-        except: pass
+    # 3. Prompt: el prefijo (personalidad + inventario) viene cacheado por versión
+    # La consulta para elegir fichas: lo último que se habló (incluye la vitrina que mandó el bot)
+    consulta = " ".join(m['content'] for m in historial[-4:])
+    with metricas.span("prompt"):
+        mensajes_para_enviar = construir_mensajes_sistema(agente, inventario, texto_agenda, ahora, consulta) + historial
 
-    # 4. Inventario (Lo preparamos para que la IA lo entienda bien)
-    texto_propiedades = ""
-    for p in propiedades:
-        ficha = (p.get('ficha_texto') or '')[:500]
-        # Clasificación simple
-        tipo = "PROPIEDAD"
-        t_low = p['titulo'].lower()
-        if "casa" in t_low: tipo = "CASA"
-        elif "terreno" in t_low or "lote" in t_low: tipo = "TERRENO"
-        elif "depa" in t_low: tipo = "DEPARTAMENTO"
-
-        texto_propiedades += f"""
-        ---
-        TIPO: {tipo}
-        TITULO: {p['titulo']}
-        PRECIO: {p['precio']}
-        UBICACION: {p['ubicacion']}
-        URL_FOTO: {p['foto_url']}
-        RESUMEN: {p['descripcion']}
-        DETALLES: {ficha}...
-        ---
-        """
-
-    # 5. EL PROMPT "CARISMÁTICO Y EFICIENTE" 🌟
-    prompt_sistema = f"""
-    Eres {agente['nombre']}, un Asesor Inmobiliario profesional, AMABLE y CARISMÁTICO.
-    
-    TU PERSONALIDAD:
-    - Usa emojis moderados (🏡, ✨, 📍, 👋) para sonar amigable.
-    - Muestra entusiasmo por las propiedades.
-    - No seas "seco", pero tampoco mandes textos infinitos.
-    
-    ESTRATEGIA DE VENTAS (EMBUDO):
-    
-    1. **VITRINA (El gancho):**
-       Si preguntan "¿Qué tienes?" o "Busco casa", responde con entusiasmo mostrando una lista atractiva pero resumida.
-       *Ejemplo:* "¡Hola! 👋 Tengo estas opciones increíbles para ti: 
-       1. 🏡 Casa de Campo (Zona Sur) - Ideal para descansar.
-       2. 🏢 Depa Minimalista (Norte) - Perfecto para ejecutivos.
-       ¿Cuál te llama la atención? 👀"
-       (NO pongas precio ni foto todavía, genera curiosidad).
-
-    2. **DETALLE (El enamoramiento):**
-       Si el cliente dice "Me interesa la 1", "A ver la casa", o pregunta detalles específicos... ¡AHORA SÍ!
-       - Da la descripción vendedora.
-       - Da el PRECIO.
-       - **OBLIGATORIO:** Pon la foto al final con: FOTO:URL_EXACTA
-
-    3. **CIERRE (La cita):**
-       Si el cliente dice "Quiero verla" o "Agendar cita":
-       - Revisa tu agenda ({texto_agenda}) y propón horarios.
-       - **REGLA DE ORO:** Antes de confirmar, di amablemente: "¡Me encantaría mostrártela! 📝 Para registrar tu visita en el sistema, ¿me podrías regalar tu nombre completo y edad, por favor? 😊".
-       - NO agendes hasta tener esos datos.
-
-    --- FORMATO DE COMANDOS ---
-    - Para mandar foto: Texto... FOTO:URL_AQUI
-    - Para confirmar cita (Solo con Nombre+Edad+Fecha):
-      AGENDA_CITA|Nombre|Edad|Perfil|YYYY-MM-DD HH:MM|MensajeAmable
-
-    --- DATOS ---
-    HOY: {dia_semana_str}, {fecha_hoy_str}
-    INVENTARIO DISPONIBLE:
-    {texto_propiedades}
-    """
-
-    mensajes_para_enviar = [{"role": "system", "content": prompt_sistema}] + historial_conversaciones[numero_usuario]
+    # 4. Cache de respuestas (sólo inicios de plática sin datos personales ni cita, y con contexto completo)
+    clave_respuesta = None if not completo else cache_respuestas.clave(agente, inventario['version'], historial, ahora.strftime("%Y-%m-%d"),
+                                             texto_agenda)
+    respuesta_ia = cache_respuestas.buscar(clave_respuesta) if clave_respuesta else None
 
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=mensajes_para_enviar,
-            model="gpt-4o-mini",
-            temperature=0.7 # <--- Subimos temperatura para recuperar el carisma
-        )
-        respuesta_ia = chat_completion.choices[0].message.content
-    except Exception as e:
-        print(f"Error OpenAI: {e}")
-        return str(MessagingResponse().message("Dame un segundo, estoy revisando el sistema... 🤖"))
+    if respuesta_ia is None:
+        tokens_estimados = sum(estimar_tokens(m['content']) for m in mensajes_para_enviar) + TOKENS_SALIDA_ESTIMADOS
+        # Con plazo: la cola del LLM sólo puede usar lo que sobre después de reservar la llamada
+        espera = None if limite is None else limite - time.monotonic() - RESERVA_LLM
 
-    historial_conversaciones[numero_usuario].append({"role": "assistant", "content": respuesta_ia})
-    
+        def llamar_openai():
+            # El timeout se calcula al salir de la cola (y en cada reintento), con lo que queda del plazo
+            opciones = {}
+            if limite is not None:
+                opciones["timeout"] = limite - time.monotonic()
+                if opciones["timeout"] < 1.0: raise Saturado("plazo del turno agotado")
+            return cliente_llm.chat.completions.create(
+                messages=mensajes_para_enviar,
+                model="gpt-4o-mini",
+                temperature=0.7, # <--- Subimos temperatura para recuperar el carisma
+                **opciones
+            )
+
+        try:
+            with metricas.span("openai"):
+                chat_completion = admision_llm.llamar(
+                    llamar_openai,
+                    tokens_estimados, prioridad_turno(historial),
+                    tokens_reales=lambda r: r.usage.total_tokens if getattr(r, 'usage', None) else None,
+                    espera_maxima=espera,
+                )
+            respuesta_ia = chat_completion.choices[0].message.content
+        except Saturado:
+            # Plantilla barata; no va al historial para que el próximo turno retome la pregunta
+            metricas.contar("llm_descartados_total", 1, "Turnos contestados con plantilla por saturación",
+                            agente=agente_id)
+            return TEXTO_SATURADO, None
+        except Exception as e:
+            metricas.error("openai", e)
+            return "Dame un segundo, estoy revisando el sistema... 🤖", None
+        uso = getattr(chat_completion, 'usage', None)
+        if uso:
+            metricas.contar("openai_tokens_total", uso.prompt_tokens, "Tokens de OpenAI por agente", agente=agente_id, tipo="prompt")
+            metricas.contar("openai_tokens_total", uso.completion_tokens, "Tokens de OpenAI por agente", agente=agente_id, tipo="completion")
+        if clave_respuesta:
+            cache_respuestas.guardar(clave_respuesta, respuesta_ia, uso.total_tokens if uso else 0)
+
+    conversaciones.agregar(clave_conversacion, "assistant", respuesta_ia)
+    with metricas.span("postproceso"):
+        mensaje_final, url_media = _postprocesar(respuesta_ia, agente, agente_id, numero_usuario)
+        return mensaje_final, url_para_whatsapp(url_media, agente_id)
+
+def _postprocesar(respuesta_ia, agente, agente_id, numero_usuario):
+    """Comandos FOTO: y AGENDA_CITA| de la respuesta del LLM -> (texto, url_media)"""
     mensaje_final = respuesta_ia
     url_media = None
 
@@ -180,24 +400,313 @@ def bot():
                 fecha_hora = partes[4]
                 mensaje_bonito = partes[5]
 
-                guardar_lead_completo(nombre, numero_usuario, edad, perfil, f"Cita: {fecha_hora}")
+                clave = clave_cita(agente_id, numero_usuario, fecha_hora)
+                guardar_lead_completo(agente_id, nombre, numero_usuario, edad, perfil, f"Cita: {fecha_hora}", clave)
                 
                 if agente.get('calendar_email'):
-                    link = crear_evento(agente['calendar_email'], nombre, fecha_hora)
-                    mensaje_final = f"{mensaje_bonito}\n\n🗓️ Ver en calendario: {link}"
-                else:
-                    mensaje_final = mensaje_bonito
+                    escrituras.encolar("cita", {"calendario": agente['calendar_email'], "nombre": nombre,
+                                                "fecha_hora": fecha_hora, "id_evento": clave}, f"cita:{clave}")
+                mensaje_final = mensaje_bonito
             else:
                 mensaje_final = respuesta_ia.replace("AGENDA_CITA|", "")
-        except:
+        except Exception as e:
+            metricas.error("agenda_cita", e)
             mensaje_final = "¡Listo! Cita agendada. 📝"
 
+    return mensaje_final, url_media
+
+# --- SECUENCIADOR: un turno a la vez por conversación y ráfagas en un solo turno ---
+secuenciador = Secuenciador(
+    ventana=float(os.getenv("BOT_VENTANA_RAFAGA", "1.5")),
+    espera_maxima=float(os.getenv("BOT_ESPERA_MAXIMA_RAFAGA", "4")),
+    ruta_bloqueos=os.getenv("BOT_BLOQUEOS_DIR"),  # carpeta compartida si hay varios workers
+)
+
+def clave_secuencia(numero_usuario, numero_bot):
+    return f"{numero_bot}|{numero_usuario}"
+
+def procesar_en_orden(numero_usuario, mensaje_usuario, numero_bot=None):
+    """Modo síncrono: procesar_mensaje por el secuenciador; (None, None) si el mensaje se fue en la ráfaga de otro"""
+    limite = time.monotonic() + PLAZO_TURNO  # el reloj de Twilio empezó con este request
+    resultado = secuenciador.turno(clave_secuencia(numero_usuario, numero_bot), mensaje_usuario,
+                                   lambda texto: procesar_mensaje(numero_usuario, texto, numero_bot, limite))
+    return resultado if resultado is not None else (None, None)
+
+def atender_turno(numero_usuario, mensaje_usuario, numero_bot=None):
+    """Modo asíncrono (worker): el mensaje ya está en el secuenciador; se procesa la ráfaga completa"""
+    resultado = secuenciador.atender(clave_secuencia(numero_usuario, numero_bot),
+                                     lambda texto: procesar_mensaje(numero_usuario, texto, numero_bot))
+    return resultado if resultado is not None else (None, None)
+
+# --- MODO ASÍNCRONO (opcional): contestamos a Twilio de inmediato y respondemos por la API ---
+MODO_ASINCRONO = os.getenv("BOT_MODO_ASINCRONO", "0") == "1"
+cola_mensajes = None
+
+# --- ARRANQUE: hilos de fondo y precalentado (una vez por proceso, después del fork de gunicorn) ---
+_arranque_lock = threading.Lock()
+_iniciado = False
+_listo = False
+
+def iniciar():
+    """Arranca los hilos de fondo de este proceso (idempotente); True sólo para quien arrancó"""
+    global _iniciado, cola_mensajes
+    with _arranque_lock:
+        if _iniciado: return False
+        escrituras.iniciar()
+        if MODO_ASINCRONO:
+            enviador = EnviadorFalso() if os.getenv("BOT_ENVIADOR") == "falso" else EnviadorTwilio()
+            cola_mensajes = ColaMensajes(
+                atender_turno, enviador,
+                workers=int(os.getenv("BOT_WORKERS", "8")),
+                max_cola=int(os.getenv("BOT_MAX_COLA", "1000")),
+                reintentos=int(os.getenv("BOT_REINTENTOS", "3")),
+            )
+        _iniciado = True
+        return True
+
+def detener(timeout=20):
+    """Al apagar el worker (ej. reciclado por max_requests): en modo asíncrono Twilio ya recibió su 200,
+    así que los turnos encolados se terminan antes de salir en vez de perderse con los hilos"""
+    if cola_mensajes is None: return
+    pendientes = cola_mensajes.cerrar(timeout)
+    if pendientes:
+        print(f"⚠️ {pendientes} mensaje(s) sin contestar al apagar el worker (pid {os.getpid()})")
+    else:
+        print(f"Cola vacía, worker {os.getpid()} apagado")
+
+def _precalentar_agente(agente_id):
+    agente = obtener_datos_agente(agente_id)
+    inventario = obtener_inventario(agente_id)
+    if agente: prefijo_estatico(agente, inventario)  # deja el render del prompt en cache
+    return agente
+
+def precalentar():
+    """Antes de recibir tráfico: índice de números, agentes + inventario + prompt, y calendario.
+    Lo que falle aquí se vuelve a intentar solo con el primer mensaje; nunca impide arrancar."""
+    global _listo
+    inicio = time.monotonic()
+    try:
+        inquilinos.refrescar()
+    except Exception as e:
+        metricas.error("precalentar", e)
+    ids = inquilinos.agentes_activos()
+    agentes = []
+    for futuro in [pool_etapas.submit(_precalentar_agente, a) for a in ids]:
+        try:
+            agente = futuro.result(timeout=ETAPA_TIMEOUT_DB * 4)
+            if agente: agentes.append(agente)
+        except Exception as e:
+            metricas.error("precalentar", e)
+    # Credenciales de Google + ocupado de todos los calendarios en consultas de 50
+    calendarios = [a['calendar_email'] for a in agentes if a.get('calendar_email')]
+    if calendarios:
+        try:
+            obtener_ocupado(calendarios)
+        except Exception as e:
+            metricas.error("precalentar", e)
+    _listo = True
+    print(f"🔥 Precalentado: {len(ids)} agentes, {len(calendarios)} calendarios "
+          f"en {time.monotonic() - inicio:.1f}s (pid {os.getpid()})")
+
+def crear_app():
+    """Fábrica para servidores WSGI (ver gunicorn.conf.py): arranca y precalienta este proceso"""
+    iniciar()
+    _precalentar_o_marcar()
+    return app
+
+def _precalentar_o_marcar():
+    if os.getenv("BOT_PRECALENTAR", "1") == "1":
+        precalentar()
+    else:
+        global _listo
+        _listo = True
+
+@app.before_request
+def _antes_de_cada_request():
+    # Por si el servidor importó 'app:app' directo en vez de usar crear_app(): se arranca con el primer
+    # request y se precalienta en segundo plano (/salud/listo da 503 hasta que termine, no para siempre)
+    if not _iniciado and iniciar():
+        print("⚠️ La app se sirvió sin crear_app() (usa 'app:crear_app()'); precalentando en segundo plano")
+        threading.Thread(target=_precalentar_o_marcar, name="precalentar", daemon=True).start()
+    if avisos is not None:
+        for agente_id in avisos.pendientes():
+            invalidar_cache(agente_id)
+
+@app.route('/bot', methods=['POST'])
+def bot():
+    mensaje_usuario = request.values.get('Body', '')
+    numero_usuario = request.values.get('From', '')
+    numero_bot = request.values.get('To', '')
+
     resp = MessagingResponse()
+    # Filtro barato antes de encolar o gastar en OpenAI
+    agente_id, activo = resolver_agente(numero_bot)
+    if agente_id is None or not activo:
+        print(f"Mensaje ignorado: número {numero_bot} sin agente activo")
+        return str(resp)
+
+    if cola_mensajes is not None:
+        clave = clave_secuencia(numero_usuario, numero_bot)
+        if not secuenciador.recibir(clave, mensaje_usuario):
+            return str(resp)  # se suma al turno que ya está en la cola
+        if cola_mensajes.encolar(numero_usuario, mensaje_usuario, numero_bot):
+            return str(resp)  # TwiML vacío: la respuesta llega por la API
+        secuenciador.cancelar(clave)
+        resp.message("Tenemos muchos mensajes en este momento, te contesto en un ratito 🙏")
+        return str(resp)
+
+    mensaje_final, url_media = procesar_en_orden(numero_usuario, mensaje_usuario, numero_bot)
+    if mensaje_final is None:  # agente sin servicio, o lo contesta el turno de la ráfaga
+        return str(resp)
     msg = resp.message()
     msg.body(mensaje_final)
     if url_media: msg.media(url_media)
     
     return str(resp)
 
+# --- CACHE: INVALIDACIÓN Y MÉTRICAS ---
+@app.route('/cache/invalidar', methods=['POST'])
+def cache_invalidar():
+    # Cada llamada recarga el índice de inquilinos desde Supabase: sin token configurado queda cerrado
+    if not CACHE_TOKEN or request.headers.get('X-Cache-Token') != CACHE_TOKEN:
+        return jsonify({"error": "no autorizado"}), 403
+    datos = request.get_json(silent=True) or request.values
+    agente_id = datos.get('agente_id')
+    if agente_id is not None:
+        try:
+            agente_id = int(agente_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "agente_id inválido"}), 400
+    invalidar_cache(agente_id)
+    if avisos is not None: avisos.publicar(agente_id)  # y a los demás workers
+    return jsonify({"ok": True})
+
+# --- SALUD: el balanceador sólo manda tráfico a workers listos ---
+@app.route('/salud', methods=['GET'])
+def salud():
+    return jsonify({"ok": True, "pid": os.getpid()})
+
+@app.route('/salud/listo', methods=['GET'])
+def salud_listo():
+    estado = {
+        "precalentado": _listo,
+        "escrituras": escrituras.vivo(),
+        "cola": cola_mensajes is not None or not MODO_ASINCRONO,
+        "inquilinos": len(inquilinos),
+    }
+    listo = estado["precalentado"] and estado["escrituras"] and estado["cola"]
+    return jsonify({"listo": listo, **estado, "pid": os.getpid()}), 200 if listo else 503
+
+@app.route('/media/<nombre>', methods=['GET'])
+def media(nombre):
+    h = nombre[:-4] if nombre.endswith(".jpg") else nombre
+    ruta = medios.ruta(h)
+    if ruta is None: abort(404)
+    # Contenido direccionado por hash: nunca cambia, se puede cachear para siempre
+    resp = send_file(ruta, mimetype="image/jpeg", etag=h, conditional=True, max_age=365 * 24 * 3600)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+@app.route('/media/precalentar', methods=['POST'])
+def media_precalentar():
+    # Hace que el servidor descargue URLs: sin token configurado queda cerrado
+    if not CACHE_TOKEN or request.headers.get('X-Cache-Token') != CACHE_TOKEN:
+        return jsonify({"error": "no autorizado"}), 403
+    datos = request.get_json(silent=True) or {}
+    try:
+        agente_id = int(datos.get('agente_id'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "falta agente_id o no es válido"}), 400
+    urls = datos.get('urls') or ([datos['url']] if datos.get('url') else [])
+    fotos = fotos_del_agente(agente_id)
+    aceptadas = [u for u in urls if u in fotos]
+    for url in aceptadas:
+        precalentar_foto(url)
+    return jsonify({"ok": True, "urls": len(aceptadas), "rechazadas": len(urls) - len(aceptadas),
+                    "activo": bool(MEDIA_URL_BASE)})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "agentes": cache_agentes.estadisticas(),
+        "inventario": cache_inventario.estadisticas(),
+    })
+
+# --- MÉTRICAS (Prometheus) ---
+def _recolectar_gauges():
+    muestras = []
+    caches = {"agentes": cache_agentes, "inventario": cache_inventario, "prompts": cache_prompts,
+              "calendario": cache_ocupado}
+    for nombre, cache in caches.items():
+        st = cache.estadisticas()
+        muestras += [
+            ("cache_hits_total", "counter", "Hits por cache", {"cache": nombre}, st['hits']),
+            ("cache_misses_total", "counter", "Misses por cache", {"cache": nombre}, st['misses']),
+            ("cache_items", "gauge", "Entradas vivas por cache", {"cache": nombre}, st['items']),
+        ]
+    resp = cache_respuestas.estadisticas()
+    muestras += [
+        ("respuestas_cache_hits_total", "counter", "Respuestas del LLM servidas de cache", {}, resp['hits']),
+        ("respuestas_cache_saltados_total", "counter", "Turnos que no se pueden cachear", {}, resp['saltados']),
+        ("respuestas_tokens_ahorrados_total", "counter", "Tokens ahorrados por la cache de respuestas", {}, resp['tokens_ahorrados']),
+    ]
+    for intencion, n in router.estadisticas()['por_intencion'].items():
+        muestras.append(("router_decisiones_total", "counter", "Decisiones del router", {"intencion": intencion}, n))
+    muestras.append(("conversaciones_activas", "gauge", "Conversaciones en memoria/SQLite", {},
+                     conversaciones.estadisticas()['conversaciones']))
+    for estado, n in escrituras.estadisticas().items():
+        if estado in ("pendiente", "tomado", "muerto"):
+            muestras.append(("escrituras_en_cola", "gauge", "Leads/citas en la cola local", {"estado": estado}, n))
+    if cola_mensajes is not None:
+        cola = cola_mensajes.estadisticas()
+        muestras += [
+            ("cola_profundidad", "gauge", "Mensajes esperando worker", {}, cola['profundidad']),
+            ("cola_muertos", "gauge", "Mensajes en la cola de muertos", {}, cola['muertos']),
+            ("cola_rechazados_total", "counter", "Mensajes rechazados por cola llena", {}, cola['rechazados']),
+        ]
+    muestras.append(("inquilinos", "gauge", "Agentes en el índice de números", {}, len(inquilinos)))
+    llm = admision_llm.estadisticas()
+    muestras += [
+        ("llm_cola_profundidad", "gauge", "Turnos esperando lugar para llamar a OpenAI", {}, llm['en_cola']),
+        ("llm_en_vuelo", "gauge", "Llamadas a OpenAI en curso", {}, llm['en_vuelo']),
+        ("llm_tokens_disponibles", "gauge", "Tokens que quedan en la cubeta por minuto", {}, llm['tokens_disponibles']),
+        ("llm_reintentos_429_total", "counter", "Reintentos por 429 de OpenAI", {}, llm['reintentos_429']),
+    ]
+    med = medios.estadisticas()
+    muestras += [
+        ("medios_procesados_total", "counter", "Fotos descargadas y recomprimidas", {}, med['procesadas']),
+        ("medios_fallidos_total", "counter", "Fotos que no se pudieron bajar o leer", {}, med['fallidas']),
+    ]
+    sec = secuenciador.estadisticas()
+    muestras += [
+        ("turnos_total", "counter", "Turnos procesados (después de agrupar ráfagas)", {}, sec['turnos']),
+        ("mensajes_agrupados_total", "counter", "Mensajes contestados dentro del turno de otro", {}, sec['mensajes_agrupados']),
+    ]
+    return muestras
+
+metricas.registrar_recolector(_recolectar_gauges)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/respuestas/stats', methods=['GET'])
+def respuestas_stats():
+    return jsonify(cache_respuestas.estadisticas())
+
+@app.route('/router/stats', methods=['GET'])
+def router_stats():
+    return jsonify(router.estadisticas())
+
+@app.route('/cola/stats', methods=['GET'])
+def cola_stats():
+    escrituras_stats = escrituras.estadisticas()
+    extra = {"escrituras": escrituras_stats, "secuenciador": secuenciador.estadisticas(),
+             "llm": admision_llm.estadisticas()}
+    if cola_mensajes is None:
+        return jsonify({"modo": "sincrono", **extra})
+    return jsonify({"modo": "asincrono", **cola_mensajes.estadisticas(), **extra})
+
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False, port=5000)
\ No newline at end of file
+    # Desarrollo. En producción: gunicorn -c gunicorn.conf.py
+    crear_app().run(debug=True, use_reloader=False, port=5000)
@@ -0,0 +1,80 @@
+import os
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from supabase import create_client
+from openai import OpenAI
+import ingesta_pdf
+
+# Backfill de una sola vez: genera el 'digest' de las propiedades que se subieron antes de tenerlo.
+# Requiere la columna (ver ingesta_pdf.MIGRACION_DIGEST):  alter table propiedades add column if not exists digest jsonb;
+# Recorre por id (keyset) en lotes; si una fila falla se queda sin digest y el bot usa la ficha recortada.
+#
+#   python backfill_digest.py --lote 100 --concurrencia 4 [--dry-run]
+
+load_dotenv('test.env')
+
+def filas_sin_digest(supabase, desde_id, lote):
+    return (supabase.table('propiedades')
+            .select("id, agente_id, titulo, precio, ubicacion, descripcion, ficha_texto")
+            .is_('digest', 'null').gt('id', desde_id).order('id').limit(lote)
+            .execute().data)
+
+def texto_para_llm(fila):
+    """La ficha completa si existe; si no, lo que tengamos de la fila"""
+    if len(fila.get('ficha_texto') or '') >= ingesta_pdf.MIN_CARACTERES:
+        return fila['ficha_texto']
+    return " | ".join(str(fila.get(c)) for c in ("titulo", "precio", "ubicacion", "descripcion") if fila.get(c))
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera digests para propiedades existentes")
+    parser.add_argument("--lote", type=int, default=100)
+    parser.add_argument("--concurrencia", type=int, default=4, help="llamadas al LLM en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="no escribe nada, sólo muestra")
+    args = parser.parse_args()
+
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    analizar = ingesta_pdf.analizador_openai(OpenAI(api_key=os.getenv('OPENAI_API_KEY')))
+
+    def procesar(fila):
+        try:
+            digest = ingesta_pdf.digest_de(analizar(texto_para_llm(fila)))
+            if not digest: return fila, None, "el LLM no regresó datos"
+            if not args.dry_run:
+                supabase.table('propiedades').update({"digest": digest}).eq('id', fila['id']).execute()
+            return fila, digest, None
+        except Exception as e:
+            return fila, None, str(e)
+
+    ultimo_id, hechas, fallidas, agentes = 0, 0, 0, set()
+    inicio = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        while True:
+            filas = filas_sin_digest(supabase, ultimo_id, args.lote)
+            if not filas: break
+            ultimo_id = filas[-1]['id']
+            for fila, digest, error in pool.map(procesar, filas):
+                if error:
+                    fallidas += 1
+                    print(f"❌ {fila['id']} {fila.get('titulo')}: {error}")
+                else:
+                    hechas += 1
+                    agentes.add(fila['agente_id'])
+                    if args.dry_run: print(f"{fila['id']} {fila.get('titulo')}: {digest}")
+            print(f"... hasta id {ultimo_id}: {hechas} con digest, {fallidas} fallidas ({time.time() - inicio:.0f}s)")
+
+    # Que el bot vuelva a renderizar el inventario de los agentes tocados (si no, lo hace al vencer su TTL)
+    bot_url = os.getenv("BOT_URL")
+    if bot_url and not args.dry_run:
+        for agente_id in agentes:
+            try:
+                requests.post(f"{bot_url}/cache/invalidar", json={"agente_id": agente_id},
+                              headers={"X-Cache-Token": os.getenv("CACHE_TOKEN", "")}, timeout=2)
+            except Exception as e:
+                print(f"Aviso bot: {e}")
+    print(f"Listo: {hechas} propiedades con digest, {fallidas} fallidas, {len(agentes)} agentes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""Banco de pruebas de carga del webhook /bot sin servicios reales.
+
+Reemplaza Supabase, OpenAI, Google Calendar y Twilio con dobles en memoria (con latencia
+configurable) y repite tráfico tipo Twilio (form-encoded) de muchos números a la vez.
+
+    python benchmark_bot.py --usuarios 300 --concurrencia 30 --latencia-llm 0.6
+    python benchmark_bot.py --asincrono
+    python benchmark_bot.py --rafaga 3 --ventana 0.5   # ráfagas de 3 mensajes seguidos por turno
+
+Contra varios workers reales (mismos dobles dentro de cada worker):
+    gunicorn -c gunicorn.conf.py --workers 4 "benchmark_bot:crear_app_falsa(latencia_llm=0.5)"
+    python benchmark_bot.py --url http://127.0.0.1:8000 --usuarios 300 --concurrencia 60
+
+Reporta p50/p95/p99, mensajes/seg, desglose por etapa y RSS del proceso en el tiempo.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+# --- REGISTRO DE TIEMPOS POR ETAPA ---
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.etapas = {}
+
+    def anotar(self, etapa, segundos):
+        with self._lock:
+            self.etapas.setdefault(etapa, []).append(segundos)
+
+registro = Registro()
+
+def _esperar(etapa, segundos):
+    # Latencia simulada con un poco de variación, como la red real
+    real = max(0.0, random.gauss(segundos, segundos * 0.2))
+    time.sleep(real)
+    registro.anotar(etapa, real)
+
+# --- SUPABASE FALSO ---
+class ConsultaFalsa:
+    def __init__(self, bd, tabla):
+        self.bd, self.tabla = bd, tabla
+        self.op, self.filtros, self.datos, self.rango, self.contar = "select", [], None, None, None
+
+    def select(self, *columnas, count=None):
+        self.op, self.contar = "select", count
+        return self
+
+    def eq(self, columna, valor):
+        self.filtros.append((columna, valor))
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def range(self, inicio, fin):
+        self.rango = (inicio, fin)
+        return self
+
+    def insert(self, datos):
+        self.op, self.datos = "insert", datos
+        return self
+
+    def update(self, datos):
+        self.op, self.datos = "update", datos
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def execute(self):
+        _esperar("supabase", self.bd.latencia)
+        filas = self.bd.tablas.setdefault(self.tabla, [])
+        elegidas = [f for f in filas if all(f.get(c) == v for c, v in self.filtros)]
+        with self.bd.lock:
+            if self.op == "insert":
+                nuevas = self.datos if isinstance(self.datos, list) else [self.datos]
+                for n in nuevas:
+                    n.setdefault("id", len(filas) + 1)
+                filas.extend(nuevas)
+                elegidas = nuevas
+            elif self.op == "update":
+                for f in elegidas: f.update(self.datos)
+            elif self.op == "delete":
+                self.bd.tablas[self.tabla] = [f for f in filas if f not in elegidas]
+        if self.rango:
+            elegidas = elegidas[self.rango[0]:self.rango[1] + 1]
+        return SimpleNamespace(data=[dict(f) for f in elegidas], count=len(elegidas) if self.contar else None)
+
+class SupabaseFalso:
+    def __init__(self, agentes, propiedades_por_agente, latencia):
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        tipos = ["Casa", "Depa", "Terreno", "Penthouse"]
+        zonas = ["Polanco", "Coyoacán", "Zona Sur", "Norte", "Juriquilla", "Tulum"]
+        self.tablas = {"agentes": [], "propiedades": [], "clientes": []}
+        for a in range(1, agentes + 1):
+            self.tablas["agentes"].append({
+                "id": a, "nombre": f"Agente {a}", "telefono": f"52155{a:08d}", "rol": "agente",
+                "calendar_email": f"agente{a}@example.com", "suscripcion_fin": "2099-01-01",
+            })
+            for i in range(propiedades_por_agente):
+                tipo, zona = random.choice(tipos), random.choice(zonas)
+                self.tablas["propiedades"].append({
+                    "id": a * 100000 + i, "agente_id": a, "titulo": f"{tipo} en {zona} {i + 1}",
+                    "precio": f"${random.randint(1, 20)},500,000", "ubicacion": zona,
+                    "foto_url": f"https://fotos.example/{a}/{i}.jpg", "descripcion": f"{tipo} con jardín en {zona}.",
+                    "ficha_texto": f"{tipo} {zona}, 3 recámaras, 2 baños, alberca, 180 m2. " * 20,
+                })
+
+    def table(self, nombre):
+        return ConsultaFalsa(self, nombre)
+
+# --- OPENAI FALSO ---
+class OpenAIFalso:
+    def __init__(self, latencia, ms_por_token, tokens_salida):
+        self.latencia, self.ms_por_token, self.tokens_salida = latencia, ms_por_token, tokens_salida
+        self.llamadas = 0
+        self.tokens_prompt = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._crear))
+
+    def with_options(self, **opciones):
+        return self
+
+    def _crear(self, messages, model=None, temperature=None, **kwargs):
+        prompt = sum(len(m['content']) for m in messages) // 4
+        self.llamadas += 1
+        self.tokens_prompt += prompt
+        _esperar("openai", self.latencia + self.tokens_salida * self.ms_por_token / 1000)
+        ultimo = messages[-1]['content'].lower()
+        if "años" in ultimo:
+            texto = "AGENDA_CITA|Juan Pérez|34|Familia|2030-01-10 11:00|¡Listo! Te espero 😊"
+        elif "interesa" in ultimo:
+            texto = "¡Excelente elección! ✨ Tiene jardín y alberca. Precio: $3,500,000 FOTO:https://fotos.example/1/1.jpg"
+        else:
+            texto = "¡Hola! 👋 " + "Con gusto te cuento más. " * (self.tokens_salida // 6)
+        uso = SimpleNamespace(prompt_tokens=prompt, completion_tokens=self.tokens_salida,
+                              total_tokens=prompt + self.tokens_salida)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=texto))], usage=uso)
+
+# --- GOOGLE CALENDAR FALSO ---
+class LlamadaFalsa:
+    def __init__(self, resultado, latencia):
+        self.resultado, self.latencia = resultado, latencia
+
+    def execute(self):
+        _esperar("calendar", self.latencia)
+        return self.resultado
+
+class CalendarFalso:
+    """Se instala con agenda_helper.configurar_cliente(); imita servicio().freebusy() y .events()"""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+
+    def servicio(self):
+        return self
+
+    def freebusy(self):
+        return SimpleNamespace(query=lambda body: LlamadaFalsa(
+            {"calendars": {item["id"]: {"busy": []} for item in body["items"]}}, self.latencia))
+
+    def events(self):
+        return SimpleNamespace(insert=lambda calendarId, body: LlamadaFalsa(
+            {"htmlLink": "https://calendar.example/evento"}, self.latencia))
+
+# --- RSS ---
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # pico, no actual
+
+class MuestreoRSS(threading.Thread):
+    def __init__(self, cada=0.5):
+        super().__init__(daemon=True)
+        self.cada, self.muestras, self.inicio = cada, [], time.perf_counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            self.muestras.append((time.perf_counter() - self.inicio, rss_mb()))
+            self._parar.wait(self.cada)
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+# --- TRÁFICO ---
+GUION = ["Hola", "¿Qué tienes?", "Me interesa la 2", "¿Tiene alberca y cuántas recámaras?",
+         "¿En qué zona está exactamente?", "Quiero verla", "Juan Pérez, 34 años, el jueves a las 11"]
+
+def percentil(valores, p):
+    if not valores: return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+def trafico(args, post, latencias, errores):
+    """Corre las conversaciones; post(form) -> status HTTP"""
+    lock = threading.Lock()
+
+    def enviar(u, agente, sid, cuerpo):
+        form = {
+            "SmsMessageSid": sid, "MessageSid": sid, "AccountSid": "ACfalso",
+            "From": f"whatsapp:+521{3300000000 + u}", "To": f"whatsapp:+52155{agente:08d}",
+            "Body": cuerpo, "NumMedia": "0", "ProfileName": f"Cliente {u}",
+            "WaId": f"521{3300000000 + u}", "ApiVersion": "2010-04-01",
+        }
+        t0 = time.perf_counter()
+        status = post(form)
+        dt = time.perf_counter() - t0
+        with lock:
+            latencias.append(dt)
+            if status != 200: errores[0] += 1
+
+    def conversar(u):
+        agente = random.randint(1, args.agentes)
+        for i in range(args.turnos):
+            sid = f"SM{u:06d}{i:02d}"
+            if args.rafaga <= 1:
+                enviar(u, agente, sid, GUION[i % len(GUION)])
+                continue
+            # El mensaje del guion y unos cuantos más pegados, como escribe la gente
+            cuerpos = [GUION[i % len(GUION)]] + ["¿me ayudas?"] * (args.rafaga - 1)
+            hilos = [threading.Thread(target=enviar, args=(u, agente, f"{sid}{j}", c)) for j, c in enumerate(cuerpos)]
+            for h in hilos:
+                h.start()
+                time.sleep(0.02)
+            for h in hilos: h.join()
+
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        list(pool.map(conversar, range(args.usuarios)))
+
+def reporte_latencias(args, latencias, errores, total):
+    n = len(latencias)
+    destino = args.url or f"modo {'asíncrono' if args.asincrono else 'síncrono'}"
+    print(f"\n=== /bot: {n} mensajes, {args.usuarios} números, concurrencia {args.concurrencia}, {destino} ===")
+    print(f"Throughput: {n / total:.1f} msg/s ({total:.1f}s en total, {errores[0]} errores)")
+    print(f"Latencia webhook: p50 {percentil(latencias, 50) * 1000:.0f} ms | p95 {percentil(latencias, 95) * 1000:.0f} ms"
+          f" | p99 {percentil(latencias, 99) * 1000:.0f} ms | máx {max(latencias) * 1000:.0f} ms")
+
+def contra_servidor(args):
+    """Sólo tráfico y latencias: las métricas internas viven en cada worker (ver /metrics)"""
+    import requests
+    locales = threading.local()
+
+    def post(form):
+        sesion = getattr(locales, "sesion", None)
+        if sesion is None:
+            sesion = locales.sesion = requests.Session()
+        try:
+            return sesion.post(f"{args.url.rstrip('/')}/bot", data=form, timeout=30).status_code
+        except requests.RequestException:
+            return 0
+
+    latencias, errores = [], [0]
+    inicio = time.perf_counter()
+    trafico(args, post, latencias, errores)
+    reporte_latencias(args, latencias, errores, time.perf_counter() - inicio)
+
+def parser():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--usuarios", type=int, default=200, help="conversaciones distintas (números de WhatsApp)")
+    ap.add_argument("--concurrencia", type=int, default=20, help="conversaciones activas a la vez")
+    ap.add_argument("--agentes", type=int, default=10)
+    ap.add_argument("--propiedades", type=int, default=40, help="propiedades por agente")
+    ap.add_argument("--turnos", type=int, default=len(GUION), help="mensajes por conversación")
+    ap.add_argument("--latencia-db", type=float, default=0.03)
+    ap.add_argument("--latencia-calendar", type=float, default=0.15)
+    ap.add_argument("--latencia-llm", type=float, default=0.5, help="tiempo hasta el primer token (seg)")
+    ap.add_argument("--ms-por-token", type=float, default=8.0)
+    ap.add_argument("--tokens-salida", type=int, default=60)
+    ap.add_argument("--asincrono", action="store_true", help="mide el modo BOT_MODO_ASINCRONO=1")
+    ap.add_argument("--rafaga", type=int, default=1, help="mensajes seguidos (a la vez) en cada turno")
+    ap.add_argument("--ventana", type=float, default=float(os.getenv("BOT_VENTANA_RAFAGA", "1.5")),
+                    help="BOT_VENTANA_RAFAGA en segundos, por defecto la de la app (0 = sólo se agrupa lo que llega mientras el turno espera)")
+    ap.add_argument("--url", help="manda el tráfico por HTTP a un servidor ya levantado (ej. gunicorn)")
+    return ap
+
+def instalar_dobles(args):
+    """Reemplaza Supabase, OpenAI y Calendar antes de importar la app"""
+    supabase_falso = SupabaseFalso(args.agentes, args.propiedades, args.latencia_db)
+    openai_falso = OpenAIFalso(args.latencia_llm, args.ms_por_token, args.tokens_salida)
+    import supabase as supabase_mod
+    import openai as openai_mod
+    supabase_mod.create_client = lambda url, key, *a, **k: supabase_falso
+    openai_mod.OpenAI = lambda *a, **k: openai_falso
+
+    import agenda_helper
+    agenda_helper.configurar_cliente(CalendarFalso(args.latencia_calendar))
+    return supabase_falso, openai_falso
+
+def crear_app_falsa(**opciones):
+    """Fábrica para gunicorn: la app real con los dobles instalados en cada worker"""
+    args = parser().parse_args([])
+    for nombre, valor in opciones.items():
+        setattr(args, nombre, valor)
+    random.seed(11)  # mismos agentes y propiedades en todos los workers
+    for variable, valor in {"SUPABASE_URL": "http://supabase.local", "SUPABASE_KEY": "falsa",
+                            "OPENAI_API_KEY": "falsa", "BOT_ENVIADOR": "falso"}.items():
+        os.environ.setdefault(variable, valor)
+    instalar_dobles(args)
+    import app as app_mod
+    return app_mod.crear_app()
+
+def main():
+    args = parser().parse_args()
+    random.seed(11)
+    if args.url:
+        return contra_servidor(args)
+
+    # Configuración antes de importar la app (lee todo al importar)
+    tmp = tempfile.mkdtemp(prefix="inmobot_bench_")
+    os.environ.update({
+        "SUPABASE_URL": "http://supabase.local", "SUPABASE_KEY": "falsa", "OPENAI_API_KEY": "falsa",
+        "ESCRITURAS_DB": os.path.join(tmp, "escrituras.db"), "CONVERSACIONES_BACKEND": "memoria",
+        "BOT_MODO_ASINCRONO": "1" if args.asincrono else "0", "BOT_ENVIADOR": "falso",
+        "BOT_VENTANA_RAFAGA": str(args.ventana),
+    })
+    os.environ.pop("CACHE_RESPUESTAS_DB", None)
+    os.environ.pop("AGENTE_POR_DEFECTO", None)
+
+    supabase_falso, openai_falso = instalar_dobles(args)
+    import app as app_mod
+    app_mod.app.logger.disabled = True
+    import builtins
+    print_original = builtins.print
+    builtins.print = lambda *a, **k: None  # la app imprime cada turno; no ensuciamos el reporte
+    app_mod.crear_app()
+
+    latencias, errores = [], [0]
+    locales = threading.local()
+
+    def post(form):
+        cliente = getattr(locales, "cliente", None)
+        if cliente is None:
+            cliente = locales.cliente = app_mod.app.test_client()
+        return cliente.post("/bot", data=form).status_code
+
+    rss = MuestreoRSS()
+    rss.start()
+    inicio = time.perf_counter()
+    trafico(args, post, latencias, errores)
+    if args.asincrono:
+        app_mod.cola_mensajes.esperar_vacia()
+    total = time.perf_counter() - inicio
+    rss.parar()
+    builtins.print = print_original
+
+    n = len(latencias)
+    reporte_latencias(args, latencias, errores, total)
+    if args.asincrono:
+        enviados = len(app_mod.cola_mensajes.enviador.enviados)
+        print(f"Respuestas enviadas por la API: {enviados} ({enviados / total:.1f}/s)")
+    print(f"Llamadas a OpenAI: {openai_falso.llamadas} de {n} mensajes "
+          f"(~{openai_falso.tokens_prompt // max(1, openai_falso.llamadas)} tokens de prompt en promedio)")
+    sec = app_mod.secuenciador.estadisticas()
+    print(f"Turnos: {sec['turnos']} con ventana de ráfaga de {args.ventana:g}s ({sec['mensajes_agrupados']} mensajes agrupados en la ráfaga de otro)")
+    llm = app_mod.admision_llm.estadisticas()
+    print(f"Admisión LLM: {llm['admitidos']} admitidas, {llm['descartados']} contestadas con plantilla, "
+          f"{llm['reintentos_429']} reintentos por 429")
+
+    print("\nDesglose por etapa (llamadas a servicios externos simulados):")
+    print(f"{'etapa':>10} | {'llamadas':>8} | {'p50 ms':>7} | {'p95 ms':>7} | {'total s':>8}")
+    for etapa, valores in sorted(registro.etapas.items()):
+        print(f"{etapa:>10} | {len(valores):>8} | {percentil(valores, 50) * 1000:>7.0f} | "
+              f"{percentil(valores, 95) * 1000:>7.0f} | {sum(valores):>8.1f}")
+
+    # Lo mismo visto desde dentro de la app: spans de /metrics (promedio = _sum / _count)
+    texto = app_mod.app.test_client().get("/metrics").get_data(as_text=True)
+    spans = {}
+    for linea in texto.splitlines():
+        m = re.match(r'inmobot_etapa_segundos_(sum|count)\{etapa="([^"]+)"\} (\S+)', linea)
+        if m: spans.setdefault(m.group(2), {})[m.group(1)] = float(m.group(3))
+    print("\nSpans de la app (/metrics):")
+    print(f"{'etapa':>18} | {'llamadas':>8} | {'prom ms':>7} | {'total s':>8}")
+    for etapa, v in sorted(spans.items()):
+        print(f"{etapa:>18} | {v['count']:>8.0f} | {v['sum'] / max(1, v['count']) * 1000:>7.1f} | {v['sum']:>8.1f}")
+
+    print("\nRSS del proceso (MB):")
+    paso = max(1, len(rss.muestras) // 10)
+    for t, mb in rss.muestras[::paso]:
+        print(f"  t={t:6.1f}s  {mb:7.1f}")
+    if rss.muestras:
+        print(f"  inicio {rss.muestras[0][1]:.1f} | pico {max(m for _, m in rss.muestras):.1f} | final {rss.muestras[-1][1]:.1f}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Cache en memoria del proceso: LRU con TTL por entrada.
+# Lo usa el bot para no ir a Supabase en cada mensaje de WhatsApp.
+
+class CacheLRU:
+    def __init__(self, max_items=256, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (valor, expira_en)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def buscar(self, clave):
+        """Valor vigente o None (cuenta como hit/miss)"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[1] > ahora:
+                self._datos.move_to_end(clave)
+                self.hits += 1
+                return entrada[0]
+            self.misses += 1
+            return None
+
+    def obtener(self, clave, cargar):
+        """Regresa el valor cacheado o lo carga con cargar() si no existe o ya expiró"""
+        valor = self.buscar(clave)
+        if valor is not None:
+            return valor
+
+        # La carga va fuera del lock para no frenar a los demás hilos
+        valor = cargar()
+        if valor is not None:
+            self.guardar(clave, valor)
+        return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+                self.expulsiones += 1
+
+    def modificar(self, clave, funcion):
+        """Parcha una entrada vigente sin tocar su expiración; si no hay entrada no hace nada"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[1] > time.monotonic():
+                self._datos[clave] = (funcion(entrada[0]), entrada[1])
+
+    def invalidar(self, clave):
+        with self._lock:
+            if self._datos.pop(clave, None) is not None:
+                self.invalidaciones += 1
+
+    def limpiar(self):
+        with self._lock:
+            self.invalidaciones += len(self._datos)
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._datos),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "expulsiones": self.expulsiones,
+                "invalidaciones": self.invalidaciones,
+            }
+
+class AvisosInvalidacion:
+    """Invalidaciones compartidas entre procesos de la misma máquina.
+    /cache/invalidar le llega a un solo worker de gunicorn; los demás leen esta tabla
+    (como mucho una vez por 'cada' segundos) y tiran lo mismo de su cache."""
+
+    def __init__(self, ruta, cada=1.0, retener=3600):
+        self.ruta = ruta
+        self.cada = cada
+        self.retener = retener
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._siguiente = 0.0
+        con = self._conexion()
+        con.execute("CREATE TABLE IF NOT EXISTS avisos "
+                    "(id INTEGER PRIMARY KEY AUTOINCREMENT, agente_id TEXT, creado REAL NOT NULL)")
+        # Lo anterior a que arrancó este proceso ya no aplica: su cache empieza vacío
+        self._visto = con.execute("SELECT COALESCE(MAX(id), 0) FROM avisos").fetchone()[0]
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def publicar(self, agente_id=None):
+        con = self._conexion()
+        ahora = time.time()
+        con.execute("INSERT INTO avisos (agente_id, creado) VALUES (?, ?)",
+                    (str(agente_id) if agente_id is not None else None, ahora))
+        con.execute("DELETE FROM avisos WHERE creado < ?", (ahora - self.retener,))
+
+    def pendientes(self):
+        """agente_id (o None = todos) de los avisos nuevos; [] si aún no toca revisar"""
+        if time.monotonic() < self._siguiente: return []
+        if not self._lock.acquire(blocking=False): return []  # otro hilo ya está revisando
+        try:
+            self._siguiente = time.monotonic() + self.cada
+            filas = self._conexion().execute("SELECT id, agente_id FROM avisos WHERE id > ? ORDER BY id",
+                                             (self._visto,)).fetchall()
+            if filas: self._visto = filas[-1][0]
+            return [f[1] for f in filas]
+        finally:
+            self._lock.release()
@@ -0,0 +1,118 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from cache_local import CacheLRU
+
+# Cache de respuestas del LLM para pláticas que empiezan igual
+# (mismo agente, mismo inventario, mismos primeros mensajes, mismo día).
+# Se salta solo en cuanto hay datos personales o ya se está agendando.
+
+MAX_TURNOS = 6  # pláticas más largas casi nunca se repiten; no vale la pena cachearlas
+
+# Señales de datos personales (en lo que escribe el cliente) o de la etapa de cita (en cualquiera)
+DATOS_PERSONALES = re.compile(r"\d{2,}|@|\bme llamo\b|\bmi nombre\b|\bsoy [a-z]+ [a-z]+|\btengo \w+ anos\b")
+ETAPA_CITA = re.compile(r"agenda_cita|\bnombre completo\b|\bcita\b|\bagendar\b|\bvisita\b")
+# Respuestas que ofrecen horarios: dependen de la agenda del momento, no se reutilizan
+HORARIOS = re.compile(r"\b\d{1,2}( \d{2})? ?(am|pm|hrs?|horas)\b|\b\d{1,2} \d{2}\b|\bhorarios?\b|\bdisponib")
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s@]", " ", texto).split())
+
+class CacheRespuestas:
+    def __init__(self, max_items=2000, ttl=24 * 3600, ruta_sqlite=None, max_filas=20000, purgar_cada=100):
+        self.ttl = ttl
+        self.max_filas = max_filas        # tope de la tabla SQLite (la memoria ya la acota el LRU)
+        self.purgar_cada = purgar_cada
+        self._escrituras = 0
+        self._memoria = CacheLRU(max_items=max_items, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saltados = 0
+        self.tokens_ahorrados = 0
+        self._con = None
+        if ruta_sqlite:
+            self._con = sqlite3.connect(ruta_sqlite, check_same_thread=False, timeout=10)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("CREATE TABLE IF NOT EXISTS respuestas "
+                              "(clave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, tokens INTEGER, creado REAL NOT NULL)")
+            self._con.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_creado ON respuestas(creado)")
+            self._con.commit()
+
+    def clave(self, agente, version_inventario, historial, fecha, agenda=""):
+        """Clave del turno o None si no se debe cachear (plática larga, datos personales, cita).
+        La agenda entra en la clave: si se ocupa un horario, la respuesta cacheada ya no aplica."""
+        if len(historial) > MAX_TURNOS or any(m['role'] == 'system' for m in historial):
+            return self._saltar()
+        turnos = []
+        for m in historial:
+            texto = normalizar(m['content'])
+            if ETAPA_CITA.search(texto) or (m['role'] == 'user' and DATOS_PERSONALES.search(texto)):
+                return self._saltar()
+            turnos.append([m['role'], texto])
+        firma = json.dumps([agente.get('id'), agente.get('nombre'), version_inventario, fecha,
+                            hashlib.sha1((agenda or "").encode()).hexdigest(), turnos],
+                           ensure_ascii=False)
+        return hashlib.sha256(firma.encode()).hexdigest()
+
+    def _saltar(self):
+        with self._lock:
+            self.saltados += 1
+        return None
+
+    def buscar(self, clave):
+        entrada = self._memoria.buscar(clave)
+        if entrada is None and self._con is not None:
+            with self._lock:
+                fila = self._con.execute("SELECT respuesta, tokens FROM respuestas WHERE clave=? AND creado>?",
+                                         (clave, time.time() - self.ttl)).fetchone()
+            if fila:
+                entrada = {"respuesta": fila[0], "tokens": fila[1] or 0}
+                self._memoria.guardar(clave, entrada)
+        with self._lock:
+            if entrada is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tokens_ahorrados += entrada['tokens']
+        return entrada['respuesta']
+
+    def guardar(self, clave, respuesta, tokens=0):
+        """Guarda la respuesta salvo que ya hable de la cita u ofrezca horarios; True si se guardó"""
+        texto = normalizar(respuesta)
+        if "AGENDA_CITA" in (respuesta or "") or ETAPA_CITA.search(texto) or HORARIOS.search(texto):
+            self._saltar()
+            return False
+        entrada = {"respuesta": respuesta, "tokens": tokens or 0}
+        self._memoria.guardar(clave, entrada)
+        if self._con is not None:
+            with self._lock:
+                ahora = time.time()
+                self._con.execute("INSERT OR REPLACE INTO respuestas (clave, respuesta, tokens, creado) VALUES (?, ?, ?, ?)",
+                                  (clave, respuesta, entrada['tokens'], ahora))
+                self._escrituras += 1
+                if self._escrituras % self.purgar_cada == 0:
+                    # Vencidas fuera, y si aún sobra, las más viejas (no crece sin límite)
+                    self._con.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl,))
+                    self._con.execute("DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas "
+                                      "ORDER BY creado DESC LIMIT -1 OFFSET ?)", (self.max_filas,))
+                self._con.commit()
+        return True
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saltados": self.saltados,
+                "hit_rate": round(self.hits / consultas, 4) if consultas else 0.0,
+                "tokens_ahorrados": self.tokens_ahorrados,
+                "items_memoria": self._memoria.estadisticas()['items'],
+            }
@@ -0,0 +1,150 @@
+import json
+import time
+import random
+import sqlite3
+import threading
+
+# Escritura diferida de leads y citas.
+# El webhook sólo hace un INSERT local en SQLite (durable); un hilo de fondo vacía la cola
+# hacia Supabase / Google Calendar en lotes, con reintentos y backoff.
+# La clave de idempotencia evita duplicar una cita si la misma línea AGENDA_CITA se procesa dos veces.
+
+class EscrituraDiferida:
+    def __init__(self, ruta="escrituras.db", intervalo=1.0, max_intentos=8, espera_base=2.0,
+                 retener_hechos=7 * 24 * 3600, tiempo_tomado=300):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.retener_hechos = retener_hechos    # las claves hechas se guardan un rato para idempotencia
+        self.tiempo_tomado = tiempo_tomado      # si un worker murió con filas tomadas, se liberan
+        self._ejecutores = {}                   # tipo -> (funcion(lista_payloads), tamaño_lote)
+        self._local = threading.local()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self.enviados = 0
+        self.fallidos = 0
+        self._conexion().executescript("""
+            CREATE TABLE IF NOT EXISTS escrituras (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                clave TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',  -- pendiente | tomado | hecho | muerto
+                intentos INTEGER NOT NULL DEFAULT 0,
+                siguiente REAL NOT NULL,
+                tomado REAL,
+                error TEXT,
+                creado REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_escrituras_estado ON escrituras(estado, siguiente);
+        """)
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def registrar(self, tipo, funcion, lote=1):
+        """funcion recibe una lista de payloads. Si el lote falla se repite fila por fila y sólo
+        se reintenta la que falla. Usa lote=1 para operaciones que no se pueden repetir a medias (ej. crear eventos)."""
+        self._ejecutores[tipo] = (funcion, lote)
+
+    def encolar(self, tipo, payload, clave):
+        """True si es nueva; False si esa clave ya estaba (no se duplica)"""
+        ahora = time.time()
+        cur = self._conexion().execute(
+            "INSERT OR IGNORE INTO escrituras (tipo, clave, payload, siguiente, creado) VALUES (?, ?, ?, ?, ?)",
+            (tipo, clave, json.dumps(payload, default=str), ahora, ahora))
+        self._despertar.set()
+        return cur.rowcount == 1
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="escrituras", daemon=True)
+            self._hilo.start()
+
+    def vivo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                while self.vaciar():
+                    pass
+            except Exception as e:
+                print(f"Error vaciando escrituras: {e}")
+
+    def _tomar(self, tipo, lote):
+        """Marca filas como 'tomado' en una transacción para que otro proceso no las repita"""
+        con = self._conexion()
+        ahora = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("UPDATE escrituras SET estado='pendiente' WHERE estado='tomado' AND tomado < ?",
+                        (ahora - self.tiempo_tomado,))
+            filas = con.execute(
+                "SELECT id, payload, intentos FROM escrituras WHERE tipo=? AND estado='pendiente' AND siguiente<=? "
+                "ORDER BY id LIMIT ?", (tipo, ahora, lote)).fetchall()
+            con.executemany("UPDATE escrituras SET estado='tomado', tomado=? WHERE id=?",
+                            [(ahora, f[0]) for f in filas])
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return filas
+
+    def _fallo(self, con, filas, e):
+        """Reintento con backoff (o 'muerto' si ya se agotaron los intentos) para estas filas"""
+        self.fallidos += len(filas)
+        ahora = time.time()
+        for id_fila, _, intentos in filas:
+            intentos += 1
+            estado = 'muerto' if intentos >= self.max_intentos else 'pendiente'
+            espera = self.espera_base * (2 ** intentos) * random.uniform(0.5, 1.5)
+            con.execute("UPDATE escrituras SET estado=?, intentos=?, siguiente=?, error=? WHERE id=?",
+                        (estado, intentos, ahora + espera, str(e)[:500], id_fila))
+
+    def _hecho(self, con, filas):
+        con.executemany("UPDATE escrituras SET estado='hecho', error=NULL WHERE id=?", [(f[0],) for f in filas])
+        self.enviados += len(filas)
+
+    def vaciar(self):
+        """Procesa un lote por tipo; regresa cuántas filas se intentaron"""
+        con = self._conexion()
+        total, hubo_error = 0, False
+        for tipo, (funcion, lote) in self._ejecutores.items():
+            filas = self._tomar(tipo, lote)
+            if not filas: continue
+            total += len(filas)
+            try:
+                funcion([json.loads(f[1]) for f in filas])
+                self._hecho(con, filas)
+                continue
+            except Exception as e:
+                if len(filas) == 1:
+                    print(f"Error escribiendo {tipo} (se reintenta): {e}")
+                    hubo_error = True
+                    self._fallo(con, filas, e)
+                    continue
+                print(f"Error escribiendo lote de {tipo}, se intenta fila por fila: {e}")
+            # Una fila mala no debe arrastrar a las otras 49 a 'muerto'
+            for fila in filas:
+                try:
+                    funcion([json.loads(fila[1])])
+                    self._hecho(con, [fila])
+                except Exception as e:
+                    print(f"Error escribiendo {tipo} #{fila[0]} (se reintenta): {e}")
+                    hubo_error = True
+                    self._fallo(con, [fila], e)
+        con.execute("DELETE FROM escrituras WHERE estado='hecho' AND creado < ?", (time.time() - self.retener_hechos,))
+        # Sólo seguimos vaciando en caliente si hubo éxito; si todo falló esperamos al siguiente ciclo
+        return 0 if hubo_error else total
+
+    def estadisticas(self):
+        filas = self._conexion().execute("SELECT estado, COUNT(*) FROM escrituras GROUP BY estado").fetchall()
+        return {"enviados": self.enviados, "fallidos": self.fallidos, **{estado: n for estado, n in filas}}
@@ -0,0 +1,131 @@
+import os
+import time
+import queue
+import random
+import threading
+from collections import deque
+
+# Modo asíncrono del webhook: /bot encola el mensaje y contesta a Twilio al instante;
+# un pool de hilos procesa (Supabase, calendario, OpenAI) y manda la respuesta
+# por la API REST de mensajes de Twilio.
+
+class EnviadorTwilio:
+    def __init__(self, account_sid=None, auth_token=None):
+        from twilio.rest import Client as TwilioClient
+        self.cliente = TwilioClient(account_sid or os.getenv("TWILIO_ACCOUNT_SID"),
+                                    auth_token or os.getenv("TWILIO_AUTH_TOKEN"))
+
+    def enviar(self, de, para, texto, url_media=None):
+        self.cliente.messages.create(
+            from_=de, to=para, body=texto,
+            media_url=[url_media] if url_media else None
+        )
+
+class EnviadorFalso:
+    """Guarda lo que se hubiera mandado; para pruebas locales sin Twilio"""
+
+    def __init__(self, fallar_veces=0):
+        self.enviados = []
+        self.fallar_veces = fallar_veces
+
+    def enviar(self, de, para, texto, url_media=None):
+        if self.fallar_veces > 0:
+            self.fallar_veces -= 1
+            raise RuntimeError("Fallo simulado de Twilio")
+        self.enviados.append({"de": de, "para": para, "texto": texto, "media": url_media})
+
+class ColaMensajes:
+    """Cola acotada + pool de workers con reintentos y cola de mensajes muertos"""
+
+    def __init__(self, procesar, enviador, workers=4, max_cola=1000, reintentos=3, espera_base=1.0):
+        self.procesar = procesar        # (numero, mensaje, para) -> (texto, url_media)
+        self.enviador = enviador
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._cola = queue.Queue(maxsize=max_cola)
+        self.muertos = deque(maxlen=1000)
+        self.procesados = 0
+        self.rechazados = 0
+        self.reintentados = 0
+        self._lock = threading.Lock()
+        self._cerrada = False
+        self._hilos = []
+        for i in range(workers):
+            hilo = threading.Thread(target=self._trabajar, name=f"bot-worker-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def encolar(self, numero, mensaje, para):
+        """False si la cola está llena o cerrada (el webhook decide qué contestar)"""
+        if self._cerrada:
+            with self._lock:
+                self.rechazados += 1
+            return False
+        try:
+            self._cola.put_nowait({"numero": numero, "mensaje": mensaje, "para": para,
+                                   "intentos": 0, "respuesta": None, "encolado": time.time()})
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rechazados += 1
+            return False
+
+    def profundidad(self):
+        return self._cola.qsize()
+
+    def esperar_vacia(self):
+        self._cola.join()
+
+    def cerrar(self, timeout=None):
+        """Deja de aceptar mensajes y espera (hasta timeout) a que se procese lo encolado.
+        Regresa cuántos quedaron sin terminar."""
+        self._cerrada = True
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cola.all_tasks_done:
+            while self._cola.unfinished_tasks:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0: break
+                self._cola.all_tasks_done.wait(restante)
+            return self._cola.unfinished_tasks
+
+    def _trabajar(self):
+        while True:
+            trabajo = self._cola.get()
+            try:
+                self._ejecutar(trabajo)
+            finally:
+                self._cola.task_done()
+
+    def _ejecutar(self, trabajo):
+        while True:
+            try:
+                # Si ya se procesó y sólo falló el envío, no volvemos a llamar a OpenAI
+                if trabajo['respuesta'] is None:
+                    trabajo['respuesta'] = self.procesar(trabajo['numero'], trabajo['mensaje'], trabajo['para'])
+                texto, url_media = trabajo['respuesta']
+                if texto is not None:  # None = no hay que contestar (ej. agente vencido)
+                    self.enviador.enviar(trabajo['para'], trabajo['numero'], texto, url_media)
+                with self._lock:
+                    self.procesados += 1
+                return
+            except Exception as e:
+                trabajo['intentos'] += 1
+                if trabajo['intentos'] > self.reintentos:
+                    print(f"Mensaje a cola de muertos ({trabajo['numero']}): {e}")
+                    trabajo['error'] = str(e)
+                    self.muertos.append(trabajo)
+                    return
+                with self._lock:
+                    self.reintentados += 1
+                # Backoff exponencial con jitter
+                time.sleep(self.espera_base * (2 ** (trabajo['intentos'] - 1)) * random.uniform(0.5, 1.5))
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "profundidad": self.profundidad(),
+                "procesados": self.procesados,
+                "reintentados": self.reintentados,
+                "rechazados": self.rechazados,
+                "muertos": len(self.muertos),
+            }
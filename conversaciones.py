@@ -0,0 +1,217 @@
+import os
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Historial de conversaciones del bot con límites:
+# - se olvidan los números inactivos (LRU + tiempo sin uso)
+# - cada plática tiene un presupuesto de tokens; los turnos viejos se pliegan en un resumen
+# Backends: memoria (un proceso) y SQLite (varios workers de gunicorn en la misma máquina).
+
+def estimar_tokens(texto):
+    # ~4 caracteres por token en español; suficiente para presupuestar
+    return len(texto or '') // 4 + 4
+
+def resumir_turnos(resumen, turnos, max_chars=800):
+    """Resumen acumulado barato (sin LLM): una línea recortada por turno, conservando lo más nuevo"""
+    lineas = [resumen] if resumen else []
+    for t in turnos:
+        quien = "Cliente" if t['role'] == 'user' else "Asesor"
+        lineas.append(f"{quien}: {' '.join(t['content'].split())[:160]}")
+    texto = "\n".join(lineas)
+    return texto[-max_chars:]
+
+class AlmacenConversaciones(ABC):
+    """Base: la lógica de presupuesto es igual para todos los backends"""
+
+    def __init__(self, max_conversaciones=5000, inactividad=6 * 3600, presupuesto_tokens=1500,
+                 max_resumen=800, resumidor=None):
+        self.max_conversaciones = max_conversaciones
+        self.inactividad = inactividad
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_resumen = max_resumen
+        self.resumidor = resumidor or resumir_turnos
+
+    @abstractmethod
+    def agregar(self, numero, rol, contenido):
+        ...
+
+    @abstractmethod
+    def historial(self, numero):
+        """Mensajes listos para OpenAI: el resumen (si hay) y luego los turnos recientes"""
+
+    @abstractmethod
+    def olvidar(self, numero):
+        ...
+
+    @abstractmethod
+    def estadisticas(self):
+        ...
+
+    def _aplicar_presupuesto(self, resumen, turnos):
+        """Saca turnos viejos hasta caber en el presupuesto y los pliega al resumen"""
+        total = sum(estimar_tokens(t['content']) for t in turnos)
+        sacados = []
+        while total > self.presupuesto_tokens and len(turnos) > 1:
+            t = turnos.pop(0)
+            total -= estimar_tokens(t['content'])
+            sacados.append(t)
+        if sacados:
+            resumen = self.resumidor(resumen, sacados, self.max_resumen)
+        return resumen, turnos, len(sacados)
+
+    @staticmethod
+    def _como_mensajes(resumen, turnos):
+        mensajes = [{"role": t['role'], "content": t['content']} for t in turnos]
+        if resumen:
+            mensajes.insert(0, {"role": "system", "content": f"RESUMEN DE LA PLÁTICA ANTERIOR:\n{resumen}"})
+        return mensajes
+
+class ConversacionesMemoria(AlmacenConversaciones):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._datos = OrderedDict()  # numero -> {"resumen", "turnos", "ultimo"}, de menos a más reciente
+        self._lock = threading.Lock()
+        self.expulsiones = 0
+
+    def _purgar(self, ahora):
+        # Como el OrderedDict va por último uso, los inactivos siempre están al principio
+        while self._datos:
+            numero, conv = next(iter(self._datos.items()))
+            if len(self._datos) <= self.max_conversaciones and conv['ultimo'] > ahora - self.inactividad:
+                break
+            self._datos.popitem(last=False)
+            self.expulsiones += 1
+
+    def agregar(self, numero, rol, contenido):
+        ahora = time.time()
+        with self._lock:
+            conv = self._datos.pop(numero, None) or {"resumen": "", "turnos": [], "ultimo": ahora}
+            conv['turnos'].append({"role": rol, "content": contenido})
+            conv['resumen'], conv['turnos'], _ = self._aplicar_presupuesto(conv['resumen'], conv['turnos'])
+            conv['ultimo'] = ahora
+            self._datos[numero] = conv
+            self._purgar(ahora)
+
+    def historial(self, numero):
+        with self._lock:
+            conv = self._datos.get(numero)
+            if conv is None: return []
+            return self._como_mensajes(conv['resumen'], conv['turnos'])
+
+    def olvidar(self, numero):
+        with self._lock:
+            self._datos.pop(numero, None)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "conversaciones": len(self._datos),
+                "turnos": sum(len(c['turnos']) for c in self._datos.values()),
+                "expulsiones": self.expulsiones,
+            }
+
+class ConversacionesSQLite(AlmacenConversaciones):
+    """Estado compartido entre procesos de la misma máquina (WAL permite lectores concurrentes)"""
+
+    def __init__(self, ruta="conversaciones.db", purgar_cada=200, **kwargs):
+        super().__init__(**kwargs)
+        self.ruta = ruta
+        self.purgar_cada = purgar_cada
+        self._local = threading.local()
+        self._escrituras = 0
+        self.expulsiones = 0
+        con = self._conexion()
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS conversaciones (
+                numero TEXT PRIMARY KEY, resumen TEXT NOT NULL DEFAULT '', ultimo REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS turnos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT NOT NULL, rol TEXT NOT NULL, contenido TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_turnos_numero ON turnos(numero, id);
+            CREATE INDEX IF NOT EXISTS idx_conv_ultimo ON conversaciones(ultimo);
+        """)
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def agregar(self, numero, rol, contenido):
+        ahora = time.time()
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            fila = con.execute("SELECT resumen FROM conversaciones WHERE numero=?", (numero,)).fetchone()
+            resumen = fila[0] if fila else ""
+            con.execute("INSERT INTO turnos (numero, rol, contenido) VALUES (?, ?, ?)", (numero, rol, contenido))
+            filas = con.execute("SELECT id, rol, contenido FROM turnos WHERE numero=? ORDER BY id", (numero,)).fetchall()
+            turnos = [{"id": i, "role": r, "content": c} for i, r, c in filas]
+            resumen, turnos, sacados = self._aplicar_presupuesto(resumen, turnos)
+            if sacados:
+                con.execute("DELETE FROM turnos WHERE numero=? AND id<?", (numero, turnos[0]['id']))
+            con.execute(
+                "INSERT INTO conversaciones (numero, resumen, ultimo) VALUES (?, ?, ?) "
+                "ON CONFLICT(numero) DO UPDATE SET resumen=excluded.resumen, ultimo=excluded.ultimo",
+                (numero, resumen, ahora))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        self._escrituras += 1
+        if self._escrituras % self.purgar_cada == 0:
+            self._purgar(ahora)
+
+    def _purgar(self, ahora):
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            inactivos = con.execute("SELECT numero FROM conversaciones WHERE ultimo < ?",
+                                    (ahora - self.inactividad,)).fetchall()
+            sobrantes = con.execute("SELECT numero FROM conversaciones ORDER BY ultimo DESC LIMIT -1 OFFSET ?",
+                                    (self.max_conversaciones,)).fetchall()
+            viejos = set(inactivos) | set(sobrantes)
+            for (numero,) in viejos:
+                con.execute("DELETE FROM turnos WHERE numero=?", (numero,))
+                con.execute("DELETE FROM conversaciones WHERE numero=?", (numero,))
+            con.execute("COMMIT")
+            self.expulsiones += len(viejos)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+    def historial(self, numero):
+        con = self._conexion()
+        fila = con.execute("SELECT resumen FROM conversaciones WHERE numero=?", (numero,)).fetchone()
+        if fila is None: return []
+        filas = con.execute("SELECT rol, contenido FROM turnos WHERE numero=? ORDER BY id", (numero,)).fetchall()
+        return self._como_mensajes(fila[0], [{"role": r, "content": c} for r, c in filas])
+
+    def olvidar(self, numero):
+        con = self._conexion()
+        con.execute("DELETE FROM turnos WHERE numero=?", (numero,))
+        con.execute("DELETE FROM conversaciones WHERE numero=?", (numero,))
+
+    def estadisticas(self):
+        con = self._conexion()
+        return {
+            "conversaciones": con.execute("SELECT COUNT(*) FROM conversaciones").fetchone()[0],
+            "turnos": con.execute("SELECT COUNT(*) FROM turnos").fetchone()[0],
+            "expulsiones": self.expulsiones,
+        }
+
+def crear_almacen():
+    """Elige backend por variables de entorno (CONVERSACIONES_BACKEND=memoria|sqlite)"""
+    opciones = dict(
+        max_conversaciones=int(os.getenv("CONVERSACIONES_MAX", "5000")),
+        inactividad=int(os.getenv("CONVERSACIONES_INACTIVIDAD", str(6 * 3600))),
+        presupuesto_tokens=int(os.getenv("CONVERSACIONES_TOKENS", "1500")),
+    )
+    if os.getenv("CONVERSACIONES_BACKEND", "memoria") == "sqlite":
+        return ConversacionesSQLite(ruta=os.getenv("CONVERSACIONES_DB", "conversaciones.db"), **opciones)
+    return ConversacionesMemoria(**opciones)
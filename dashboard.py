@@ -3,12 +3,12 @@ from supabase import create_client, Client
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
-from pypdf import PdfReader
-import json
+import ingesta_pdf
 import time
 import smtplib
 from email.mime.text import MIMEText
 import random
+import requests
 from datetime import datetime, timedelta
 
 # Cargar claves
@@ -19,6 +19,7 @@ url = os.getenv("SUPABASE_URL")
 key = os.getenv("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+BOT_URL = os.getenv("BOT_URL")  # Ej: https://mi-bot.com (para avisarle de cambios)
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(page_title="InmoBot SaaS", page_icon="🏢", layout="wide")
@@ -44,22 +45,101 @@ def enviar_codigo_correo(destinatario, codigo):
         print(f"Error email: {e}")
         return False
 
+def notificar_bot(agente_id):
+    """Le avisa al bot que tire su cache de este agente (si falla, el TTL lo cubre)"""
+    if not BOT_URL: return
+    try:
+        requests.post(f"{BOT_URL}/cache/invalidar", json={"agente_id": agente_id},
+                      headers={"X-Cache-Token": os.getenv("CACHE_TOKEN", "")}, timeout=2)
+    except Exception as e:
+        print(f"Aviso bot: {e}")
+
+def precalentar_foto(agente_id, url):
+    """Que el bot baje y reduzca la foto desde ya, no cuando un cliente la pida (sólo acepta fotos del inventario)"""
+    if not BOT_URL or not url: return
+    try:
+        requests.post(f"{BOT_URL}/media/precalentar", json={"agente_id": agente_id, "url": url},
+                      headers={"X-Cache-Token": os.getenv("CACHE_TOKEN", "")}, timeout=2)
+    except Exception as e:
+        print(f"Aviso bot (foto): {e}")
+
+@st.cache_resource
+def cache_fichas():
+    return ingesta_pdf.CacheFichas(os.getenv("INGESTA_CACHE_DB", "ingesta_cache.db"))
+
 def procesar_pdf(uploaded_file):
     try:
-        reader = PdfReader(uploaded_file)
-        texto = "".join([page.extract_text() for page in reader.pages if page.extract_text()])
-        texto = texto.replace("\x00", "")
-        if len(texto) < 50: return None, None 
-
-        prompt = f"Analiza esta ficha técnica: {texto[:10000]}. Responde JSON con: titulo, precio, ubicacion, resumen."
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
-        return texto, json.loads(response.choices[0].message.content)
+        datos_pdf = uploaded_file.getvalue()
+        h = ingesta_pdf.hash_contenido(datos_pdf)
+        guardado = cache_fichas().buscar(h)
+        if ingesta_pdf.sin_texto(guardado): return None, None  # escaneado: ya sabemos que no hay texto
+        if guardado and "pitch" in (guardado[1] or {}):
+            return guardado  # misma ficha ya analizada (con digest): ni extracción ni LLM
+
+        texto = ingesta_pdf.extraer_texto(datos_pdf)
+        if len(texto) < ingesta_pdf.MIN_CARACTERES:
+            cache_fichas().guardar(h, texto, None)
+            return None, None
+
+        datos = ingesta_pdf.analizador_openai(client)(texto)
+        cache_fichas().guardar(h, texto, datos)
+        return texto, datos
     except: return None, None
 
+# --- MÉTRICAS DEL ADMIN (cacheadas: Streamlit re-ejecuta todo en cada clic) ---
+PAGINA_BD = 1000  # PostgREST regresa máximo 1000 filas por consulta
+
+def _contar_por_agente(tabla):
+    """Cuenta filas por agente_id trayendo sólo esa columna, en páginas.
+    Sin ORDER BY Postgres no garantiza el mismo orden entre páginas (filas saltadas o repetidas)."""
+    conteos, inicio = {}, 0
+    while True:
+        filas = (supabase.table(tabla).select("agente_id").order('id')
+                 .range(inicio, inicio + PAGINA_BD - 1).execute().data)
+        for f in filas:
+            conteos[f['agente_id']] = conteos.get(f['agente_id'], 0) + 1
+        if len(filas) < PAGINA_BD: return conteos
+        inicio += PAGINA_BD
+
+@st.cache_data(ttl=120)
+def listar_agentes():
+    return supabase.table('agentes').select("*").order('id').execute().data
+
+@st.cache_data(ttl=120)
+def estadisticas_agentes():
+    """{'propiedades': {agente_id: n}, 'clientes': {agente_id: n}} en 2 consultas en vez de 2 por agente"""
+    return {"propiedades": _contar_por_agente('propiedades'), "clientes": _contar_por_agente('clientes')}
+
+def refrescar_metricas_admin():
+    listar_agentes.clear()
+    estadisticas_agentes.clear()
+
+# --- INVENTARIO DEL AGENTE (paginado, sólo las columnas que se muestran) ---
+INVENTARIO_POR_PAGINA = 20
+
+@st.cache_resource
+def versiones_inventario():
+    """agente_id -> versión; subirla invalida todas las páginas cacheadas de ese agente (en todas las sesiones)"""
+    return {}
+
+def invalidar_inventario(agente_id):
+    versiones = versiones_inventario()
+    versiones[agente_id] = versiones.get(agente_id, 0) + 1
+
+@st.cache_data(ttl=300)
+def pagina_inventario(agente_id, pagina, version):
+    """(filas, total) de una página; 'version' sólo forma parte de la llave del cache"""
+    inicio = pagina * INVENTARIO_POR_PAGINA
+    res = (supabase.table('propiedades').select("id, titulo, precio, descripcion", count="exact")
+           .eq('agente_id', agente_id).order('id')
+           .range(inicio, inicio + INVENTARIO_POR_PAGINA - 1).execute())
+    return res.data, res.count or 0
+
+@st.cache_data(ttl=300)
+def ficha_propiedad(propiedad_id):
+    res = supabase.table('propiedades').select("ficha_texto").eq('id', propiedad_id).execute()
+    return res.data[0]['ficha_texto'] if res.data else None
+
 # --- GESTIÓN DE ESTADO ---
 if 'usuario' not in st.session_state: st.session_state.usuario = None
 if 'recuperando' not in st.session_state: st.session_state.recuperando = False
@@ -74,10 +154,11 @@ def panel_admin():
     # 1. METRICAS GLOBALES
     col1, col2, col3 = st.columns(3)
     
-    # Contamos total de agentes
-    total_agentes = supabase.table('agentes').select("id", count='exact').execute().count
-    # Contamos total de propiedades en el sistema
-    total_props = supabase.table('propiedades').select("id", count='exact').execute().count
+    # Todo sale de dos consultas cacheadas (agentes + conteos agrupados)
+    agentes = listar_agentes()
+    stats = estadisticas_agentes()
+    total_agentes = len(agentes)
+    total_props = sum(stats['propiedades'].values())
     
     col1.metric("Total Agentes", total_agentes)
     col2.metric("Propiedades en Nube", total_props)
@@ -88,9 +169,6 @@ def panel_admin():
     # 2. GESTIÓN DE SUSCRIPCIONES
     st.subheader("👥 Gestión de Usuarios y Suscripciones")
     
-    # Traer todos los agentes
-    agentes = supabase.table('agentes').select("*").order('id').execute().data
-    
     for ag in agentes:
         # Lógica de Semáforo de Suscripción
         estado_color = "🟢" # Activo
@@ -116,8 +194,8 @@ def panel_admin():
             c1, c2 = st.columns(2)
             
             # Datos Informativos
-            leads = supabase.table('clientes').select("*", count='exact').eq('agente_id', ag['id']).execute().count
-            props = supabase.table('propiedades').select("*", count='exact').eq('agente_id', ag['id']).execute().count
+            leads = stats['clientes'].get(ag['id'], 0)
+            props = stats['propiedades'].get(ag['id'], 0)
             
             c1.write(f"**Teléfono:** {ag['telefono']}")
             c1.write(f"**Usuario:** {ag['usuario']}")
@@ -133,6 +211,8 @@ def panel_admin():
                         "suscripcion_fin": str(nueva_fecha),
                         "suscripcion_estado": "activa"
                     }).eq('id', ag['id']).execute()
+                    notificar_bot(ag['id'])
+                    refrescar_metricas_admin()
                     st.success("Fecha actualizada.")
                     time.sleep(1)
                     st.rerun()
@@ -153,7 +233,7 @@ def panel_admin():
         
         if st.form_submit_button("Crear Usuario"):
             try:
-                supabase.table('agentes').insert({
+                nuevo = supabase.table('agentes').insert({
                     "nombre": nombre,
                     "email": email,
                     "telefono": tel,
@@ -163,6 +243,8 @@ def panel_admin():
                     "suscripcion_fin": str(fecha_inicio.date()),
                     "suscripcion_estado": "activa"
                 }).execute()
+                if nuevo.data: notificar_bot(nuevo.data[0]['id'])  # el bot registra su número
+                refrescar_metricas_admin()
                 st.success(f"✅ Usuario creado. Usuario: {email.split('@')[0]} | Pass: {password_temp}")
                 time.sleep(2)
                 st.rerun()
@@ -201,7 +283,7 @@ def panel_agente():
 
     # Si pagó, ve su contenido normal
     st.title("🏢 Panel de Agente")
-    tab1, tab2 = st.tabs(["📄 Subir Propiedad", "📋 Mi Inventario"])
+    tab1, tab_lote, tab2 = st.tabs(["📄 Subir Propiedad", "📚 Carga Masiva", "📋 Mi Inventario"])
 
     with tab1:
         archivo_pdf = st.file_uploader("Sube ficha técnica (PDF)", type="pdf")
@@ -218,21 +300,79 @@ def panel_agente():
                         d = st.text_area("Resumen", value=datos.get("resumen"))
                         
                         if st.form_submit_button("Guardar Propiedad"):
-                            supabase.table('propiedades').insert({
+                            ingesta_pdf.insertar_propiedades(supabase, [{
                                 "agente_id": agente['id'], "titulo": t, "precio": p,
-                                "ubicacion": u, "foto_url": f, "descripcion": d, "ficha_texto": texto
-                            }).execute()
+                                "ubicacion": u, "foto_url": f, "descripcion": d, "ficha_texto": texto,
+                                "digest": ingesta_pdf.digest_de(datos)
+                            }])
+                            notificar_bot(agente['id'])
+                            precalentar_foto(agente['id'], f)
+                            invalidar_inventario(agente['id'])
                             st.toast("✅ Guardado exitosamente")
 
+    with tab_lote:
+        archivos = st.file_uploader("Sube varias fichas (PDF) o un ZIP", type=["pdf", "zip"],
+                                    accept_multiple_files=True, key="lote")
+        if archivos and st.button("Procesar lote"):
+            with st.spinner(f"Leyendo {len(archivos)} archivo(s) con IA..."):
+                inicio = time.time()
+                st.session_state.lote = ingesta_pdf.procesar_lote(
+                    [(a.name, a.getvalue()) for a in archivos],
+                    ingesta_pdf.analizador_openai(client), cache=cache_fichas(),
+                    concurrencia_llm=int(os.getenv("INGESTA_CONCURRENCIA_LLM", "4")))
+                st.session_state.lote_segundos = time.time() - inicio
+
+        lote = st.session_state.get('lote')
+        if lote:
+            nuevos = sum(1 for r in lote if r['origen'] == "nuevo")
+            st.caption(f"{len(lote)} fichas en {st.session_state.lote_segundos:.1f}s "
+                       f"({nuevos} nuevas, {len(lote) - nuevos} reutilizadas)")
+            st.dataframe([{
+                "Archivo": r['nombre'],
+                "Título": (r['datos'] or {}).get("titulo"),
+                "Precio": (r['datos'] or {}).get("precio"),
+                "Estado": r['error'] or ("✅" if r['origen'] == "nuevo" else f"♻️ {r['origen']}"),
+            } for r in lote], use_container_width=True)
+            filas = ingesta_pdf.filas_propiedades(agente['id'], lote)
+            if filas and st.button(f"Guardar {len(filas)} propiedades"):
+                ingesta_pdf.insertar_propiedades(supabase, filas)
+                notificar_bot(agente['id'])
+                invalidar_inventario(agente['id'])
+                st.session_state.lote = None
+                st.toast(f"✅ {len(filas)} propiedades guardadas")
+
     with tab2:
-        mis_casas = supabase.table('propiedades').select("*").eq('agente_id', agente['id']).execute().data
+        pagina = st.session_state.get('pagina_inventario', 0)
+        version = versiones_inventario().get(agente['id'], 0)
+        mis_casas, total = pagina_inventario(agente['id'], pagina, version)
+        paginas = max(1, -(-total // INVENTARIO_POR_PAGINA))
+        if pagina >= paginas:  # borró lo último de la última página
+            st.session_state.pagina_inventario = paginas - 1
+            st.rerun()
         if not mis_casas: st.info("No tienes propiedades.")
         for c in mis_casas:
             with st.expander(f"{c['titulo']} - {c['precio']}"):
                 st.write(c['descripcion'])
+                # La ficha completa es pesada: sólo se trae si la piden
+                if st.session_state.get(f"ficha_{c['id']}"):
+                    st.text(ficha_propiedad(c['id']) or "Sin ficha técnica.")
+                elif st.button("Ver ficha técnica", key=f"ver_{c['id']}"):
+                    st.session_state[f"ficha_{c['id']}"] = True
+                    st.rerun()
                 if st.button("Borrar", key=c['id']):
                     supabase.table('propiedades').delete().eq('id', c['id']).execute()
+                    notificar_bot(agente['id'])
+                    invalidar_inventario(agente['id'])
                     st.rerun()
+        if paginas > 1:
+            c1, c2, c3 = st.columns([1, 2, 1])
+            if c1.button("⬅️ Anterior", disabled=pagina == 0):
+                st.session_state.pagina_inventario = pagina - 1
+                st.rerun()
+            c2.caption(f"Página {pagina + 1} de {paginas} ({total} propiedades)")
+            if c3.button("Siguiente ➡️", disabled=pagina >= paginas - 1):
+                st.session_state.pagina_inventario = pagina + 1
+                st.rerun()
 
 # --- LOGIN FLOW ---
 def login_flow():
@@ -269,4 +409,4 @@ else:
     if usuario.get('rol') == 'admin':
         panel_admin() # <--- TÚ VES ESTO
     else:
-        panel_agente() # <--- TUS CLIENTES VEN ESTO
\ No newline at end of file
+        panel_agente() # <--- TUS CLIENTES VEN ESTO
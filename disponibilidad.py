@@ -0,0 +1,96 @@
+import datetime
+
+# Motor de huecos libres (puro Python, sin Google):
+# junta los intervalos ocupados, los cruza con el horario laboral y regresa
+# horarios concretos que el bot puede ofrecer.
+
+class Horario:
+    def __init__(self, hora_inicio=9, hora_fin=18, duracion_min=60, buffer_min=15, paso_min=30,
+                 dias_laborales=(0, 1, 2, 3, 4, 5)):
+        self.hora_inicio = hora_inicio
+        self.hora_fin = hora_fin
+        self.duracion = datetime.timedelta(minutes=duracion_min)
+        self.buffer = datetime.timedelta(minutes=buffer_min)
+        self.paso = datetime.timedelta(minutes=paso_min)
+        self.dias_laborales = set(dias_laborales)  # 0 = lunes
+
+def fusionar_intervalos(intervalos):
+    """[(inicio, fin)] desordenados y encimados -> ordenados y sin traslapes"""
+    fusionados = []
+    for inicio, fin in sorted(intervalos):
+        if fusionados and inicio <= fusionados[-1][1]:
+            if fin > fusionados[-1][1]:
+                fusionados[-1] = (fusionados[-1][0], fin)
+        else:
+            fusionados.append((inicio, fin))
+    return fusionados
+
+def _redondear_arriba(momento, base, paso):
+    """Alinea 'momento' a la rejilla que empieza en 'base' cada 'paso'"""
+    if momento <= base: return base
+    pasos = -(-(momento - base) // paso)
+    return base + pasos * paso
+
+def calcular_huecos(ocupado, desde, dias, horario=None):
+    """Huecos libres por día: [(inicio, fin)] a partir de 'desde' (datetime con zona) por 'dias' días.
+    'ocupado' son intervalos (inicio, fin) en cualquier orden; se respeta el buffer antes y después."""
+    horario = horario or Horario()
+    bloqueos = fusionar_intervalos((i - horario.buffer, f + horario.buffer) for i, f in ocupado)
+    huecos = []
+    j = 0  # puntero sobre bloqueos: sólo avanza, no se reinicia en cada día
+    for d in range(dias):
+        dia = desde + datetime.timedelta(days=d)
+        if dia.weekday() not in horario.dias_laborales: continue
+        abre = dia.replace(hour=horario.hora_inicio, minute=0, second=0, microsecond=0)
+        cierra = dia.replace(hour=horario.hora_fin, minute=0, second=0, microsecond=0)
+        cursor = _redondear_arriba(max(abre, desde), abre, horario.paso)
+        while j < len(bloqueos) and bloqueos[j][1] <= cursor:
+            j += 1
+        k = j
+        while cursor + horario.duracion <= cierra:
+            if k < len(bloqueos) and bloqueos[k][0] < cursor + horario.duracion:
+                # Choca con un bloqueo: saltamos al final de ese bloqueo
+                if bloqueos[k][1] > cursor:
+                    cursor = _redondear_arriba(bloqueos[k][1], abre, horario.paso)
+                k += 1
+                continue
+            huecos.append((cursor, cursor + horario.duracion))
+            cursor += horario.duracion
+    return huecos
+
+def texto_huecos(huecos, max_dias=3, max_por_dia=6):
+    """Texto corto para el prompt, con fecha exacta para que el bot arme AGENDA_CITA sin adivinar"""
+    if not huecos:
+        return "📅 No hay horarios libres en los próximos días."
+    por_dia = {}
+    for inicio, _ in huecos:
+        por_dia.setdefault(inicio.date(), []).append(inicio)
+    lineas = ["📅 *Horarios Disponibles:*"]
+    for fecha in sorted(por_dia)[:max_dias]:
+        horas = ", ".join(h.strftime("%H:%M") for h in por_dia[fecha][:max_por_dia])
+        lineas.append(f"- {por_dia[fecha][0].strftime('%A')} {fecha.isoformat()}: {horas}")
+    return "\n".join(lineas)
+
+# ==========================================
+# BENCHMARK: python disponibilidad.py
+# ==========================================
+if __name__ == '__main__':
+    import time
+    import random
+
+    random.seed(3)
+    zona = datetime.timezone(datetime.timedelta(hours=-6))
+    desde = datetime.datetime(2026, 1, 5, 8, 0, tzinfo=zona)
+    print(f"{'eventos':>8} | {'dias':>4} | {'huecos':>6} | {'ms':>8}")
+    for eventos in (100, 1000, 5000, 20000):
+        dias = 365
+        ocupado = []
+        for _ in range(eventos):
+            inicio = desde + datetime.timedelta(minutes=random.randrange(0, dias * 24 * 60, 15))
+            ocupado.append((inicio, inicio + datetime.timedelta(minutes=random.choice((30, 45, 60, 90)))))
+        repeticiones = 20
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            huecos = calcular_huecos(ocupado, desde, dias)
+        ms = (time.perf_counter() - t0) * 1000 / repeticiones
+        print(f"{eventos:>8} | {dias:>4} | {len(huecos):>6} | {ms:>8.2f}")
@@ -0,0 +1,52 @@
+import os
+import sys
+import multiprocessing
+
+# Producción:  gunicorn -c gunicorn.conf.py
+# Cada worker importa app.py por su cuenta (sin preload) y corre crear_app(): sus hilos de fondo
+# y su precalentado son propios. Lo que debe verse igual desde todos los workers va a SQLite
+# en la misma máquina (pláticas, cache de respuestas, escrituras, invalidaciones, candados).
+
+wsgi_app = "app:crear_app()"
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+# El trabajo es casi todo espera de red (Supabase, Calendar, OpenAI): pocos procesos, muchos hilos
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()) * 2)))
+worker_class = "gthread"
+# En modo síncrono cada turno ocupa su hilo también durante la ventana de ráfaga (BOT_VENTANA_RAFAGA)
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))  # Twilio corta a los 15 s
+graceful_timeout = 20
+keepalive = 5
+max_requests = 5000          # reciclar workers de vez en cuando (fragmentación de memoria; ver worker_exit)
+max_requests_jitter = 500
+accesslog = "-" if os.getenv("GUNICORN_ACCESSLOG") == "1" else None
+
+# Estado compartido entre workers (sólo se pone si no viene ya en el entorno)
+ESTADO = os.getenv("BOT_ESTADO_DIR", "estado")
+os.makedirs(ESTADO, exist_ok=True)
+for variable, valor in {
+    "CONVERSACIONES_BACKEND": "sqlite",
+    "CONVERSACIONES_DB": os.path.join(ESTADO, "conversaciones.db"),
+    "CACHE_RESPUESTAS_DB": os.path.join(ESTADO, "respuestas.db"),
+    "ESCRITURAS_DB": os.path.join(ESTADO, "escrituras.db"),
+    "INVALIDACIONES_DB": os.path.join(ESTADO, "invalidaciones.db"),
+    "BOT_BLOQUEOS_DIR": os.path.join(ESTADO, "candados"),
+    "MEDIOS_DIR": os.path.join(ESTADO, "medios"),
+}.items():
+    os.environ.setdefault(variable, valor)
+
+def post_fork(server, worker):
+    # Antes de importar app.py: el presupuesto de OpenAI (LLM_MAX_CONCURRENTES, LLM_TOKENS_POR_MINUTO)
+    # es de toda la cuenta y se reparte entre los workers reales (incluye un --workers de la línea de comandos)
+    os.environ["LLM_PROCESOS"] = str(server.cfg.workers)
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} listo")
+
+def worker_exit(server, worker):
+    # Corre en el worker al salir (reciclado o apagado): en modo asíncrono hay turnos ya aceptados
+    # en la cola en memoria; se terminan antes de que el master lo mate (graceful_timeout < timeout)
+    modulo = sys.modules.get("app")
+    if modulo is not None and hasattr(modulo, "detener"):
+        modulo.detener(timeout=worker.cfg.graceful_timeout - 2)
@@ -0,0 +1,176 @@
+import re
+import math
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+# Índice de búsqueda BM25 sobre el inventario de cada agente.
+# Así el prompt sólo lleva las k propiedades relevantes a la plática
+# (más un catálogo de una línea por propiedad) en vez de todo el inventario.
+
+STOPWORDS = {
+    "de", "la", "el", "en", "y", "a", "los", "las", "del", "un", "una", "con", "por",
+    "para", "que", "se", "es", "al", "lo", "su", "sus", "mas", "muy", "me", "mi",
+    "te", "tu", "o", "como", "tiene", "hay", "esta", "este", "esa", "ese",
+}
+
+def tokenizar(texto):
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", texto) if len(t) > 1 and t not in STOPWORDS]
+
+def texto_indexable(p):
+    campos = [p.get('titulo'), p.get('ubicacion'), p.get('precio'), p.get('descripcion'), p.get('ficha_texto')]
+    return " ".join(str(c) for c in campos if c)
+
+class IndiceBM25:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # termino -> {doc_id: frecuencia}
+        self.largos = {}                   # doc_id -> número de términos
+        self.terminos = {}                 # doc_id -> términos del documento (para bajas rápidas)
+        self.total_terminos = 0
+
+    def __len__(self):
+        return len(self.largos)
+
+    def agregar(self, doc_id, texto):
+        if doc_id in self.largos:
+            self.quitar(doc_id)
+        frecuencias = Counter(tokenizar(texto))
+        for termino, tf in frecuencias.items():
+            self.postings[termino][doc_id] = tf
+        largo = sum(frecuencias.values())
+        self.largos[doc_id] = largo
+        self.terminos[doc_id] = set(frecuencias)
+        self.total_terminos += largo
+
+    def quitar(self, doc_id):
+        largo = self.largos.pop(doc_id, None)
+        if largo is None: return
+        self.total_terminos -= largo
+        for termino in self.terminos.pop(doc_id):
+            docs = self.postings[termino]
+            docs.pop(doc_id, None)
+            if not docs: del self.postings[termino]
+
+    def buscar(self, consulta, k=5):
+        """Regresa [(doc_id, score)] de mayor a menor, sólo documentos con score > 0"""
+        n = len(self.largos)
+        if not n: return []
+        promedio = self.total_terminos / n or 1
+        scores = defaultdict(float)
+        for termino in set(tokenizar(consulta)):
+            docs = self.postings.get(termino)
+            if not docs: continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norma = self.k1 * (1 - self.b + self.b * self.largos[doc_id] / promedio)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norma)
+        return sorted(scores.items(), key=lambda x: -x[1])[:k]
+
+def _firma(p):
+    return hashlib.sha1(json.dumps(p, sort_keys=True, default=str).encode()).hexdigest()
+
+class IndicesPorAgente:
+    """Un índice por agente que se actualiza por diferencias cuando cambia la versión del inventario"""
+
+    def __init__(self):
+        self._estado = {}  # agente_id -> (version, indice, {id: firma})
+        self._lock = threading.Lock()
+
+    def indice(self, agente_id, inventario):
+        with self._lock:
+            version, indice, firmas = self._estado.get(agente_id, (None, IndiceBM25(), {}))
+            if version != inventario['version']:
+                actuales = {p['id']: p for p in inventario['propiedades']}
+                # Bajas (borradas en el dashboard)
+                for doc_id in set(firmas) - set(actuales):
+                    indice.quitar(doc_id)
+                    del firmas[doc_id]
+                # Altas y cambios
+                for doc_id, p in actuales.items():
+                    firma = _firma(p)
+                    if firmas.get(doc_id) != firma:
+                        indice.agregar(doc_id, texto_indexable(p))
+                        firmas[doc_id] = firma
+                self._estado[agente_id] = (inventario['version'], indice, firmas)
+            return indice
+
+    def olvidar(self, agente_id=None):
+        with self._lock:
+            if agente_id is None: self._estado.clear()
+            else: self._estado.pop(agente_id, None)
+
+indices = IndicesPorAgente()
+
+def propiedades_relevantes(agente_id, inventario, consulta, k=5):
+    indice = indices.indice(agente_id, inventario)
+    por_id = {p['id']: p for p in inventario['propiedades']}
+    return [por_id[doc_id] for doc_id, _ in indice.buscar(consulta, k) if doc_id in por_id]
+
+# ==========================================
+# BENCHMARK: python indice_propiedades.py
+# ==========================================
+if __name__ == '__main__':
+    import time
+    import random
+    import datetime
+    import prompt_bot
+
+    try:
+        import tiktoken
+        _enc = tiktoken.get_encoding("o200k_base")
+        contar_tokens = lambda t: len(_enc.encode(t))
+    except ImportError:
+        contar_tokens = lambda t: len(t) // 4  # aproximación sin tiktoken
+
+    random.seed(7)
+    tipos = ["Casa", "Depa", "Terreno", "Lote", "Penthouse", "Local"]
+    zonas = ["Polanco", "Coyoacán", "Zona Sur", "Norte", "Juriquilla", "Centro", "Tulum", "Valle"]
+    extras = ["alberca", "jardín", "roof garden", "vigilancia", "gimnasio", "cochera doble", "vista al mar"]
+
+    def inventario_sintetico(n):
+        props = []
+        for i in range(n):
+            tipo, zona = random.choice(tipos), random.choice(zonas)
+            elegidas = random.sample(extras, 3)
+            amenidades = ", ".join(elegidas)
+            recamaras = random.randint(1, 5)
+            props.append({
+                "id": i + 1, "titulo": f"{tipo} en {zona} #{i + 1}", "precio": f"${random.randint(1, 30)},000,000",
+                "ubicacion": zona, "foto_url": f"https://fotos.example/{i + 1}.jpg",
+                "descripcion": f"{tipo} con {amenidades} en {zona}.",
+                "ficha_texto": f"Ficha técnica {tipo} {zona}. {recamaras} recámaras, {amenidades}. " * 12,
+                "digest": {"tipo": tipo.upper(), "recamaras": recamaras, "m2": random.randint(60, 400),
+                           "amenidades": elegidas, "pitch": f"{tipo} con {amenidades} en {zona}."},
+            })
+        return {"version": f"bench-{n}", "propiedades": props}
+
+    agente = {"id": 0, "nombre": "Bench"}
+    consulta = "Busco una casa con alberca en Coyoacán"
+    ahora = datetime.datetime.now()
+    print(f"{'listados':>9} | {'tokens (fichas)':>15} | {'tokens (digest)':>15} | {'tokens (top-k)':>14} | "
+          f"{'ms 1er msg':>10} | {'ms msg cache':>12}")
+    for n in (10, 100, 1000):
+        inv = inventario_sintetico(n)
+        sin_digest = [{k: v for k, v in p.items() if k != 'digest'} for p in inv['propiedades']]
+        completo = prompt_bot.PLANTILLA_PERSONA + prompt_bot.renderizar_inventario(sin_digest)
+        con_digest = prompt_bot.PLANTILLA_PERSONA + prompt_bot.renderizar_inventario(inv['propiedades'])
+
+        t0 = time.perf_counter()
+        mensajes = prompt_bot.construir_mensajes_sistema(agente, inv, "Libre", ahora, consulta)
+        primero = (time.perf_counter() - t0) * 1000
+
+        repeticiones = 200
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            mensajes = prompt_bot.construir_mensajes_sistema(agente, inv, "Libre", ahora, consulta)
+        caliente = (time.perf_counter() - t0) * 1000 / repeticiones
+
+        tokens_topk = sum(contar_tokens(m['content']) for m in mensajes)
+        print(f"{n:>9} | {contar_tokens(completo):>15} | {contar_tokens(con_digest):>15} | {tokens_topk:>14} | "
+              f"{primero:>10.2f} | {caliente:>12.3f}")
@@ -0,0 +1,248 @@
+import io
+import os
+import re
+import json
+import time
+import zipfile
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pypdf import PdfReader
+
+# Carga masiva de fichas técnicas (PDF o ZIP con PDFs):
+# 1. se extrae el texto en un pool de procesos (pypdf es CPU puro)
+# 2. un hash del contenido evita repetir extracción y LLM para fichas ya vistas
+# 3. las llamadas al LLM corren en paralelo con un límite
+# 4. se guarda todo en 'propiedades' con un solo insert, junto con un 'digest' compacto
+#    (tipo, recámaras, m², amenidades, precio numérico, pitch) que es lo que ve el bot
+#
+# La columna 'digest' requiere esta migración (una vez, en el SQL editor de Supabase):
+#    alter table propiedades add column if not exists digest jsonb;
+# Mientras no exista, las propiedades se guardan sin digest y el bot usa la ficha recortada.
+
+PROMPT_FICHA = ("Analiza esta ficha técnica: {texto}. Responde JSON con: titulo, precio, ubicacion, resumen, "
+                "tipo (CASA, DEPARTAMENTO, TERRENO, LOCAL u OTRO), recamaras (número), banos (número), "
+                "m2 (número, construcción o terreno), amenidades (lista corta), precio_num (número, sin símbolos) "
+                "y pitch (una frase vendedora de máximo 25 palabras). Usa null si un dato no viene.")
+MIN_CARACTERES = 50
+MAX_AMENIDADES = 8
+MAX_PITCH = 200
+
+def _numero(valor, entero=False):
+    """'$2,500,000 MXN' -> 2500000.0; None si no hay número"""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        n = float(valor)
+    else:
+        m = re.search(r"\d[\d,]*(\.\d+)?", str(valor or ''))
+        if not m: return None
+        n = float(m.group(0).replace(",", ""))
+    return int(n) if entero else n
+
+def digest_de(datos):
+    """Ficha compacta para el prompt del bot a partir de lo que regresó el LLM; None si no trae nada útil"""
+    if not datos: return None
+    amenidades = datos.get("amenidades") or []
+    if isinstance(amenidades, str): amenidades = [a.strip() for a in amenidades.split(",")]
+    digest = {
+        "tipo": (datos.get("tipo") or "").upper() or None,
+        "recamaras": _numero(datos.get("recamaras"), entero=True),
+        "banos": _numero(datos.get("banos")),
+        "m2": _numero(datos.get("m2")),
+        "amenidades": [str(a) for a in amenidades if a][:MAX_AMENIDADES],
+        "precio_num": _numero(datos.get("precio_num")) or _numero(datos.get("precio")),
+        "pitch": (datos.get("pitch") or "")[:MAX_PITCH] or None,
+    }
+    return digest if any(v for v in digest.values()) else None
+
+def hash_contenido(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+def extraer_texto(datos):
+    """Texto de un PDF en bytes (una sola extracción por página). Va en otro proceso: debe ser picklable."""
+    reader = PdfReader(io.BytesIO(datos))
+    paginas = (page.extract_text() for page in reader.pages)
+    return "".join(t for t in paginas if t).replace("\x00", "")
+
+def expandir_archivos(archivos):
+    """[(nombre, bytes)] con los ZIP abiertos en sus PDFs"""
+    salida = []
+    for nombre, datos in archivos:
+        if nombre.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(datos)) as z:
+                for interno in z.namelist():
+                    if interno.lower().endswith(".pdf") and not interno.startswith("__MACOSX"):
+                        salida.append((interno, z.read(interno)))
+        else:
+            salida.append((nombre, datos))
+    return salida
+
+def analizador_openai(client, modelo="gpt-4o-mini"):
+    """Función texto -> dict que usa OpenAI en modo JSON"""
+    def analizar(texto):
+        response = client.chat.completions.create(
+            model=modelo,
+            messages=[{"role": "user", "content": PROMPT_FICHA.format(texto=texto[:10000])}],
+            response_format={"type": "json_object"}
+        )
+        return json.loads(response.choices[0].message.content)
+    return analizar
+
+class CacheFichas:
+    """hash del PDF -> (texto, datos del LLM), en SQLite para que sobreviva reinicios"""
+
+    def __init__(self, ruta="ingesta_cache.db"):
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(ruta, check_same_thread=False)
+        self._con.execute("CREATE TABLE IF NOT EXISTS fichas (hash TEXT PRIMARY KEY, texto TEXT, datos TEXT)")
+        self._con.commit()
+
+    def buscar(self, h):
+        with self._lock:
+            fila = self._con.execute("SELECT texto, datos FROM fichas WHERE hash=?", (h,)).fetchone()
+        if fila is None: return None
+        return fila[0], json.loads(fila[1]) if fila[1] else None
+
+    def guardar(self, h, texto, datos):
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO fichas (hash, texto, datos) VALUES (?, ?, ?)",
+                              (h, texto, json.dumps(datos) if datos is not None else None))
+            self._con.commit()
+
+ERROR_SIN_TEXTO = "PDF sin texto (¿escaneado?)"
+
+def sin_texto(guardado):
+    """Entrada de cache de un PDF que ya sabemos que no trae texto (escaneado): no se vuelve a extraer"""
+    return guardado is not None and guardado[1] is None and len(guardado[0] or '') < MIN_CARACTERES
+
+def procesar_lote(archivos, analizar, cache=None, procesos=None, concurrencia_llm=4):
+    """archivos: [(nombre, bytes)] (PDF o ZIP). Regresa una lista de dicts:
+    {nombre, hash, texto, datos, origen: 'cache'|'duplicado'|'nuevo', error}"""
+    archivos = expandir_archivos(archivos)
+    resultados = []
+    pendientes = {}  # hash -> índice del primer resultado con ese contenido
+    for nombre, datos in archivos:
+        h = hash_contenido(datos)
+        r = {"nombre": nombre, "hash": h, "texto": None, "datos": None, "origen": "nuevo", "error": None}
+        guardado = cache.buscar(h) if cache else None
+        if guardado and not sin_texto(guardado) and "pitch" not in (guardado[1] or {}):
+            guardado = None  # analizada con el prompt viejo (sin digest): se repite
+        if guardado:
+            r['texto'], r['datos'] = guardado
+            r['origen'] = "cache"
+            if r['datos'] is None: r['error'] = ERROR_SIN_TEXTO
+        elif h in pendientes:
+            r['origen'] = "duplicado"
+        else:
+            pendientes[h] = (len(resultados), datos)
+        resultados.append(r)
+
+    def analizar_y_guardar(r):
+        try:
+            if len(r['texto']) < MIN_CARACTERES:
+                r['error'] = ERROR_SIN_TEXTO
+                if cache: cache.guardar(r['hash'], r['texto'], None)  # resultado negativo también se recuerda
+                return
+            r['datos'] = analizar(r['texto'])
+            if cache: cache.guardar(r['hash'], r['texto'], r['datos'])
+        except Exception as e:
+            r['error'] = f"LLM: {e}"
+
+    # Extracción en procesos; en cuanto sale un texto su llamada al LLM entra al pool de hilos
+    with ProcessPoolExecutor(max_workers=procesos) as pool_cpu, \
+         ThreadPoolExecutor(max_workers=concurrencia_llm) as pool_llm:
+        extracciones = {h: pool_cpu.submit(extraer_texto, datos) for h, (_, datos) in pendientes.items()}
+        llamadas = []
+        for h, futuro in extracciones.items():
+            r = resultados[pendientes[h][0]]
+            try:
+                r['texto'] = futuro.result()
+            except Exception as e:
+                r['error'] = f"PDF ilegible: {e}"
+                continue
+            llamadas.append(pool_llm.submit(analizar_y_guardar, r))
+        for llamada in llamadas:
+            llamada.result()
+
+    # Los duplicados dentro del mismo lote copian el resultado del original
+    primeros = {r['hash']: r for r in resultados if r['origen'] == "nuevo"}
+    for r in resultados:
+        if r['origen'] == "duplicado":
+            original = primeros[r['hash']]
+            r['texto'], r['datos'], r['error'] = original['texto'], original['datos'], original['error']
+    return resultados
+
+def filas_propiedades(agente_id, resultados):
+    """Filas listas para insertar; una por contenido distinto y sin errores"""
+    filas, vistos = [], set()
+    for r in resultados:
+        if r['error'] or not r['datos'] or r['hash'] in vistos: continue
+        vistos.add(r['hash'])
+        d = r['datos']
+        filas.append({
+            "agente_id": agente_id, "titulo": d.get("titulo"), "precio": d.get("precio"),
+            "ubicacion": d.get("ubicacion"), "foto_url": "", "descripcion": d.get("resumen"),
+            "ficha_texto": r['texto'], "digest": digest_de(d),
+        })
+    return filas
+
+MIGRACION_DIGEST = "alter table propiedades add column if not exists digest jsonb;"
+_sin_columna_digest = False  # se recuerda (hasta reiniciar) para no fallar dos veces por insert
+
+def insertar_propiedades(supabase, filas, tamano_lote=200):
+    """Inserts en bloque (un viaje a la BD por cada 'tamano_lote' filas).
+    Si la tabla aún no tiene la columna digest, se guardan sin ella en vez de perder la carga."""
+    global _sin_columna_digest
+    for i in range(0, len(filas), tamano_lote):
+        lote = filas[i:i + tamano_lote]
+        if _sin_columna_digest:
+            lote = [{k: v for k, v in f.items() if k != "digest"} for f in lote]
+        try:
+            supabase.table('propiedades').insert(lote).execute()
+        except Exception as e:
+            # PostgREST: "Could not find the 'digest' column of 'propiedades' in the schema cache"
+            if _sin_columna_digest or "digest" not in str(e): raise
+            _sin_columna_digest = True
+            print(f"⚠️ Falta la columna propiedades.digest; se guarda sin digest. Migración: {MIGRACION_DIGEST}")
+            supabase.table('propiedades').insert([{k: v for k, v in f.items() if k != "digest"} for f in lote]).execute()
+    return len(filas)
+
+# ==========================================
+# BENCHMARK: python ingesta_pdf.py carpeta_con_pdfs [latencia_llm_seg]
+# LLM simulado para medir sólo nuestro pipeline
+# ==========================================
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    carpeta = sys.argv[1]
+    latencia = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    def llm_falso(texto):
+        time.sleep(latencia)
+        return {"titulo": texto[:30], "precio": "0", "ubicacion": "N/A", "resumen": texto[:100], "pitch": texto[:60]}
+
+    archivos = []
+    for nombre in sorted(os.listdir(carpeta)):
+        if nombre.lower().endswith((".pdf", ".zip")):
+            with open(os.path.join(carpeta, nombre), "rb") as f:
+                archivos.append((nombre, f.read()))
+    print(f"{len(archivos)} archivos, LLM simulado de {latencia}s")
+
+    cache = CacheFichas(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    for corrida in ("fría", "caliente (todo en cache)"):
+        t0 = time.perf_counter()
+        resultados = procesar_lote(archivos, llm_falso, cache=cache)
+        seg = time.perf_counter() - t0
+        errores = sum(1 for r in resultados if r['error'])
+        print(f"Corrida {corrida}: {len(resultados)} PDFs en {seg:.2f}s -> "
+              f"{len(resultados) / seg * 60:.0f} PDFs/min ({errores} con error)")
+
+    # Referencia: el camino viejo (uno por uno, extracción doble por página, LLM en serie)
+    t0 = time.perf_counter()
+    for _, datos in expandir_archivos(archivos):
+        reader = PdfReader(io.BytesIO(datos))
+        texto = "".join([page.extract_text() for page in reader.pages if page.extract_text()])
+        if len(texto) >= MIN_CARACTERES: llm_falso(texto)
+    seg = time.perf_counter() - t0
+    print(f"Secuencial (antes): {len(resultados)} PDFs en {seg:.2f}s -> {len(resultados) / seg * 60:.0f} PDFs/min")
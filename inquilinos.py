@@ -0,0 +1,100 @@
+import re
+import time
+import threading
+from datetime import datetime, date
+
+# Índice de inquilinos (agentes) por número de WhatsApp.
+# El webhook resuelve a qué agente va cada mensaje con el 'To' de Twilio en O(1)
+# y descarta a los de suscripción vencida antes de gastar en OpenAI.
+
+def normalizar_telefono(numero):
+    """'whatsapp:+521 55-1234-5678' y '5255 1234 5678' -> '525512345678'"""
+    digitos = re.sub(r"\D", "", numero or '')
+    # WhatsApp México a veces agrega el 1 después del 52
+    if len(digitos) == 13 and digitos.startswith("521"):
+        digitos = "52" + digitos[3:]
+    return digitos
+
+def _fecha_fin(agente):
+    fin = agente.get('suscripcion_fin')
+    if not fin: return None
+    if isinstance(fin, date): return fin
+    return datetime.strptime(str(fin)[:10], '%Y-%m-%d').date()
+
+class IndiceInquilinos:
+    def __init__(self, cargar, ttl_refresco=300):
+        self.cargar = cargar          # () -> filas de 'agentes' (id, telefono, suscripcion_fin, rol)
+        self.ttl_refresco = ttl_refresco
+        self._por_telefono = {}       # telefono normalizado -> (agente_id, fecha_fin)
+        self._expira = 0
+        self._cargado = False         # ya hubo al menos una carga buena
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._por_telefono)
+
+    def refrescar(self):
+        filas = self.cargar() or []
+        nuevo = {}
+        for ag in filas:
+            tel = normalizar_telefono(ag.get('telefono'))
+            if tel and ag.get('rol') != 'admin':
+                nuevo[tel] = (ag['id'], _fecha_fin(ag))
+        # Cambio atómico del dict: los lectores nunca ven un índice a medias
+        self._por_telefono = nuevo
+        self._expira = time.monotonic() + self.ttl_refresco
+        self._cargado = True
+
+    def marcar_vencido(self):
+        """El siguiente mensaje recarga el índice (lo llama la invalidación del dashboard)"""
+        self._expira = 0
+
+    def _refrescar_si_toca(self):
+        if time.monotonic() < self._expira: return
+        # Sólo un hilo recarga; los demás siguen con el índice anterior.
+        # Si nunca se ha cargado no hay índice anterior: esperan a la carga en curso en vez de leer uno vacío
+        if not self._lock.acquire(blocking=not self._cargado): return
+        try:
+            if time.monotonic() >= self._expira:
+                self.refrescar()
+        except Exception as e:
+            print(f"Error refrescando inquilinos: {e}")
+            self._expira = time.monotonic() + 30  # reintento pronto, sin martillar la BD
+        finally:
+            self._lock.release()
+
+    def agentes_activos(self, hoy=None):
+        """ids de agentes con suscripción vigente (para precalentar sus datos)"""
+        hoy = hoy or date.today()
+        return sorted({a for a, fin in self._por_telefono.values() if fin is None or fin >= hoy})
+
+    def resolver(self, numero_bot, hoy=None):
+        """(agente_id, activo) o (None, False) si el número no es de ningún agente"""
+        self._refrescar_si_toca()
+        entrada = self._por_telefono.get(normalizar_telefono(numero_bot))
+        if entrada is None: return None, False
+        agente_id, fecha_fin = entrada
+        activo = fecha_fin is None or fecha_fin >= (hoy or date.today())
+        return agente_id, activo
+
+# ==========================================
+# PRUEBA DE CARGA: python inquilinos.py
+# ==========================================
+if __name__ == '__main__':
+    import random
+
+    print(f"{'inquilinos':>10} | {'carga ms':>8} | {'ns/mensaje':>10}")
+    for n in (10, 1000, 10000, 100000):
+        filas = [{"id": i, "telefono": f"521{5500000000 + i}", "rol": "agente",
+                  "suscripcion_fin": "2030-01-01" if i % 7 else "2020-01-01"} for i in range(n)]
+        indice = IndiceInquilinos(lambda: filas)
+        t0 = time.perf_counter()
+        indice.refrescar()
+        carga = (time.perf_counter() - t0) * 1000
+        numeros = [f"whatsapp:+521{5500000000 + random.randrange(n)}" for _ in range(100000)]
+        hoy = date.today()
+        t0 = time.perf_counter()
+        for numero in numeros:
+            indice.resolver(numero, hoy)
+        ns = (time.perf_counter() - t0) * 1e9 / len(numeros)
+        print(f"{n:>10} | {carga:>8.1f} | {ns:>10.0f}")
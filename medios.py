@@ -0,0 +1,133 @@
+import io
+import os
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image, ImageOps
+from cache_local import CacheLRU
+
+# Fotos de propiedades servidas por nosotros en vez del original que pegó el agente:
+# se descarga una vez, se reduce y recomprime a JPEG (WhatsApp acepta hasta 5 MB)
+# y se guarda en disco con su hash de contenido como nombre.
+#   objetos/ab/<hash>.jpg  -> la imagen (inmutable: mismo hash, mismos bytes)
+#   urls/<sha1 de la url>  -> el hash que le tocó a esa URL
+
+HASH_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+LIMITE_WHATSAPP = 5 * 1024 * 1024
+
+class AlmacenMedios:
+    def __init__(self, directorio="medios", max_lado=1600, calidad=82, max_descarga=25 * 1024 * 1024,
+                 timeout=10, workers=2):
+        self.directorio = directorio
+        self.max_lado = max_lado
+        self.calidad = calidad
+        self.max_descarga = max_descarga
+        self.timeout = timeout
+        self._indice = CacheLRU(max_items=5000, ttl=24 * 3600)  # url -> hash (evita ir al disco)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="medios")
+        self._en_proceso = set()
+        self._fallos = CacheLRU(max_items=1000, ttl=600)        # URLs que fallaron: no reintentar en cada FOTO
+        self._lock = threading.Lock()
+        self.procesadas = 0
+        self.fallidas = 0
+        os.makedirs(os.path.join(directorio, "objetos"), exist_ok=True)
+        os.makedirs(os.path.join(directorio, "urls"), exist_ok=True)
+
+    def _ruta_url(self, url):
+        return os.path.join(self.directorio, "urls", hashlib.sha1(url.encode()).hexdigest())
+
+    def ruta(self, h):
+        """Archivo de un hash, o None si no existe (o el hash no es válido)"""
+        if not HASH_VALIDO.match(h or ''): return None
+        ruta = os.path.join(self.directorio, "objetos", h[:2], f"{h}.jpg")
+        return ruta if os.path.exists(ruta) else None
+
+    def hash_de_url(self, url):
+        """Hash ya procesado para esa URL, o None si aún no se descarga"""
+        h = self._indice.buscar(url)
+        if h is not None: return h
+        try:
+            with open(self._ruta_url(url)) as f:
+                h = f.read().strip()
+        except OSError:
+            return None
+        if not self.ruta(h): return None
+        self._indice.guardar(url, h)
+        return h
+
+    def _descargar(self, url):
+        if not url.lower().startswith(("http://", "https://")):
+            raise ValueError("sólo URLs http(s)")
+        with requests.get(url, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            datos = bytearray()
+            for trozo in r.iter_content(64 * 1024):
+                datos += trozo
+                if len(datos) > self.max_descarga:
+                    raise ValueError("imagen demasiado grande")
+        return bytes(datos)
+
+    def recomprimir(self, datos):
+        """Bytes de cualquier imagen -> JPEG reducido (respeta la orientación EXIF)"""
+        with Image.open(io.BytesIO(datos)) as original:
+            imagen = ImageOps.exif_transpose(original)
+            if imagen.mode != "RGB":
+                imagen = imagen.convert("RGB")
+            imagen.thumbnail((self.max_lado, self.max_lado), Image.LANCZOS)
+            calidad = self.calidad
+            while True:
+                salida = io.BytesIO()
+                imagen.save(salida, "JPEG", quality=calidad, optimize=True, progressive=True)
+                if salida.tell() <= LIMITE_WHATSAPP or calidad <= 40:
+                    return salida.getvalue()
+                calidad -= 15
+
+    def _escribir(self, ruta, datos):
+        # Escritura atómica: otro proceso nunca ve un archivo a medias
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+
+    def procesar(self, url):
+        """Descarga, reduce y guarda; regresa el hash. Si ya estaba, no hace nada."""
+        h = self.hash_de_url(url)
+        if h: return h
+        jpeg = self.recomprimir(self._descargar(url))
+        h = hashlib.sha256(jpeg).hexdigest()[:32]
+        carpeta = os.path.join(self.directorio, "objetos", h[:2])
+        os.makedirs(carpeta, exist_ok=True)
+        ruta = os.path.join(carpeta, f"{h}.jpg")
+        if not os.path.exists(ruta):
+            self._escribir(ruta, jpeg)
+        self._escribir(self._ruta_url(url), h.encode())
+        self._indice.guardar(url, h)
+        with self._lock:
+            self.procesadas += 1
+        return h
+
+    def precalentar(self, url):
+        """Procesa en segundo plano (sin bloquear el webhook); repetidas se ignoran"""
+        if not url or self.hash_de_url(url) or self._fallos.buscar(url): return
+        with self._lock:
+            if url in self._en_proceso: return
+            self._en_proceso.add(url)
+        self._pool.submit(self._precalentar, url)
+
+    def _precalentar(self, url):
+        try:
+            self.procesar(url)
+        except Exception as e:
+            self._fallos.guardar(url, True)
+            with self._lock:
+                self.fallidas += 1
+            print(f"Error medio {url}: {e}")
+        finally:
+            with self._lock:
+                self._en_proceso.discard(url)
+
+    def estadisticas(self):
+        with self._lock:
+            return {"procesadas": self.procesadas, "fallidas": self.fallidas, "en_proceso": len(self._en_proceso)}
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Métricas ligeras del bot: tiempos por etapa (spans), contadores y gauges,
+# expuestos en formato texto de Prometheus (/metrics). Opcionalmente, un log JSON por span.
+# El costo por span es un perf_counter y un update de dict bajo lock: se puede dejar prendido.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOG_JSON = os.getenv("METRICAS_LOG_JSON", "0") == "1"
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+def _formato_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares: return ""
+    escapar = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+class Metricas:
+    def __init__(self, prefijo="inmobot"):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nombre, etiquetas) -> valor
+        self._histogramas = {}   # (nombre, etiquetas) -> [conteo por bucket..., suma, total]
+        self._ayuda = {}         # nombre -> (tipo, ayuda)
+        self._recolectores = []  # funciones que regresan [(nombre, tipo, ayuda, etiquetas, valor)]
+
+    def contar(self, nombre, valor=1, ayuda="", **etiquetas):
+        clave = (f"{self.prefijo}_{nombre}", _etiquetas(etiquetas))
+        with self._lock:
+            self._ayuda.setdefault(clave[0], ("counter", ayuda))
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, segundos, ayuda="", **etiquetas):
+        clave = (f"{self.prefijo}_{nombre}", _etiquetas(etiquetas))
+        i = bisect_left(BUCKETS, segundos)
+        with self._lock:
+            self._ayuda.setdefault(clave[0], ("histogram", ayuda))
+            h = self._histogramas.get(clave)
+            if h is None:
+                h = self._histogramas[clave] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            h[i] += 1
+            h[-2] += segundos
+            h[-1] += 1
+
+    @contextmanager
+    def span(self, etapa, **etiquetas):
+        """Mide una etapa: histograma de duración + contador de errores si truena"""
+        inicio = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.observar("etapa_segundos", duracion, "Duración de cada etapa del bot", etapa=etapa)
+            if error is not None:
+                self.contar("errores_total", 1, "Errores por etapa", etapa=etapa)
+            if LOG_JSON:
+                print(json.dumps({"evento": "span", "etapa": etapa, "ms": round(duracion * 1000, 2),
+                                  "error": str(error) if error else None, **etiquetas}, ensure_ascii=False))
+
+    def medido(self, etapa, funcion):
+        """Envuelve una función para que cada llamada sea un span (útil al mandarla a un pool)"""
+        def envuelta(*args, **kwargs):
+            with self.span(etapa):
+                return funcion(*args, **kwargs)
+        return envuelta
+
+    def error(self, etapa, e):
+        """Reemplazo de los print de errores: cuenta y deja log"""
+        self.contar("errores_total", 1, "Errores por etapa", etapa=etapa)
+        if LOG_JSON:
+            print(json.dumps({"evento": "error", "etapa": etapa, "error": str(e)}, ensure_ascii=False))
+        else:
+            print(f"Error {etapa}: {e}")
+
+    def registrar_recolector(self, funcion):
+        """funcion() -> [(nombre, tipo, ayuda, {etiquetas}, valor)]; se evalúa sólo al exportar"""
+        self._recolectores.append(funcion)
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus"""
+        # Prometheus exige que las muestras de un mismo nombre vayan juntas bajo su HELP/TYPE;
+        # los recolectores emiten por caché (hits, misses, items, hits, ...), así que se agrupa por nombre
+        grupos = {}
+
+        def grupo(nombre, tipo, ayuda):
+            if nombre not in grupos:
+                grupos[nombre] = (tipo, ayuda, [])
+            return grupos[nombre][2]
+
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((k, list(v)) for k, v in self._histogramas.items())
+            ayuda = dict(self._ayuda)
+        for (nombre, etiquetas), valor in contadores:
+            grupo(nombre, *ayuda[nombre]).append(f"{nombre}{_formato_etiquetas(etiquetas)} {valor}")
+        for (nombre, etiquetas), h in histogramas:
+            muestras = grupo(nombre, *ayuda[nombre])
+            acumulado = 0
+            for limite, conteo in zip(list(BUCKETS) + ["+Inf"], h[:len(BUCKETS) + 1]):
+                acumulado += conteo
+                muestras.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, [('le', str(limite))])} {acumulado}")
+            muestras.append(f"{nombre}_sum{_formato_etiquetas(etiquetas)} {h[-2]}")
+            muestras.append(f"{nombre}_count{_formato_etiquetas(etiquetas)} {h[-1]}")
+        for recolector in self._recolectores:
+            try:
+                muestras = recolector()
+            except Exception as e:
+                print(f"Error recolectando métricas: {e}")
+                continue
+            for nombre, tipo, texto_ayuda, etiquetas, valor in muestras:
+                if valor is None: continue
+                nombre = f"{self.prefijo}_{nombre}"
+                grupo(nombre, tipo, texto_ayuda).append(f"{nombre}{_formato_etiquetas(_etiquetas(etiquetas))} {valor}")
+
+        lineas = []
+        for nombre, (tipo, texto_ayuda, muestras) in grupos.items():
+            if texto_ayuda: lineas.append(f"# HELP {nombre} {texto_ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            lineas.extend(muestras)
+        return "\n".join(lineas) + "\n"
+
+metricas = Metricas()
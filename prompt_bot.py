@@ -0,0 +1,150 @@
+import os
+import json
+import textwrap
+from cache_local import CacheLRU
+from indice_propiedades import propiedades_relevantes
+
+# Armado del prompt del bot.
+# La parte grande (personalidad + reglas + inventario) se renderiza UNA vez por
+# versión de inventario y queda idéntica byte a byte entre mensajes, así el
+# cache de prompts de OpenAI la reutiliza. Lo que cambia (fecha, agenda) va al final.
+
+PLANTILLA_PERSONA = textwrap.dedent("""\
+    Eres {nombre}, un Asesor Inmobiliario profesional, AMABLE y CARISMÁTICO.
+
+    TU PERSONALIDAD:
+    - Usa emojis moderados (🏡, ✨, 📍, 👋) para sonar amigable.
+    - Muestra entusiasmo por las propiedades.
+    - No seas "seco", pero tampoco mandes textos infinitos.
+
+    ESTRATEGIA DE VENTAS (EMBUDO):
+
+    1. **VITRINA (El gancho):**
+       Si preguntan "¿Qué tienes?" o "Busco casa", responde con entusiasmo mostrando una lista atractiva pero resumida.
+       *Ejemplo:* "¡Hola! 👋 Tengo estas opciones increíbles para ti:
+       1. 🏡 Casa de Campo (Zona Sur) - Ideal para descansar.
+       2. 🏢 Depa Minimalista (Norte) - Perfecto para ejecutivos.
+       ¿Cuál te llama la atención? 👀"
+       (NO pongas precio ni foto todavía, genera curiosidad).
+
+    2. **DETALLE (El enamoramiento):**
+       Si el cliente dice "Me interesa la 1", "A ver la casa", o pregunta detalles específicos... ¡AHORA SÍ!
+       - Da la descripción vendedora.
+       - Da el PRECIO.
+       - **OBLIGATORIO:** Pon la foto al final con: FOTO:URL_EXACTA
+
+    3. **CIERRE (La cita):**
+       Si el cliente dice "Quiero verla" o "Agendar cita":
+       - Revisa tu AGENDA (viene al final, en DATOS DE HOY) y propón horarios.
+       - **REGLA DE ORO:** Antes de confirmar, di amablemente: "¡Me encantaría mostrártela! 📝 Para registrar tu visita en el sistema, ¿me podrías regalar tu nombre completo y edad, por favor? 😊".
+       - NO agendes hasta tener esos datos.
+
+    --- FORMATO DE COMANDOS ---
+    - Para mandar foto: Texto... FOTO:URL_AQUI
+    - Para confirmar cita (Solo con Nombre+Edad+Fecha):
+      AGENDA_CITA|Nombre|Edad|Perfil|YYYY-MM-DD HH:MM|MensajeAmable
+
+    --- INVENTARIO DISPONIBLE ---
+    """)
+
+# Con inventarios grandes sólo mandamos las k propiedades relevantes a la plática
+TOP_K = int(os.getenv("PROMPT_TOP_K", "5"))
+
+# Un render por agente+versión; pocas entradas bastan
+cache_prompts = CacheLRU(max_items=500, ttl=24 * 3600)
+
+def clasificar_tipo(titulo):
+    t_low = (titulo or '').lower()
+    if "casa" in t_low: return "CASA"
+    if "terreno" in t_low or "lote" in t_low: return "TERRENO"
+    if "depa" in t_low: return "DEPARTAMENTO"
+    return "PROPIEDAD"
+
+def _digest(p):
+    """El digest viene como jsonb (dict) o como texto según la columna; None si no hay"""
+    digest = p.get('digest')
+    if isinstance(digest, str):
+        try: digest = json.loads(digest)
+        except ValueError: return None
+    return digest or None
+
+def renderizar_digest(d):
+    """'3 rec | 2 baños | 180 m² | alberca, jardín' (sólo lo que venga)"""
+    partes = []
+    if d.get('recamaras'): partes.append(f"{d['recamaras']} rec")
+    if d.get('banos'): partes.append(f"{d['banos']:g} baños")
+    if d.get('m2'): partes.append(f"{d['m2']:g} m²")
+    if d.get('amenidades'): partes.append(", ".join(d['amenidades']))
+    return " | ".join(partes)
+
+def renderizar_propiedad(p):
+    digest = _digest(p)
+    if digest:
+        # Ficha compacta generada al subir el PDF: specs útiles sin el texto crudo
+        return "\n".join([
+            "---",
+            f"TIPO: {digest.get('tipo') or clasificar_tipo(p.get('titulo'))}",
+            f"TITULO: {p.get('titulo')}",
+            f"PRECIO: {p.get('precio')}",
+            f"UBICACION: {p.get('ubicacion')}",
+            f"URL_FOTO: {p.get('foto_url')}",
+            f"DATOS: {renderizar_digest(digest)}",
+            f"RESUMEN: {digest.get('pitch') or p.get('descripcion')}",
+        ])
+    # Propiedades sin digest (aún sin backfill): la ficha recortada como antes
+    ficha = (p.get('ficha_texto') or '')[:500]
+    return "\n".join([
+        "---",
+        f"TIPO: {clasificar_tipo(p.get('titulo'))}",
+        f"TITULO: {p.get('titulo')}",
+        f"PRECIO: {p.get('precio')}",
+        f"UBICACION: {p.get('ubicacion')}",
+        f"URL_FOTO: {p.get('foto_url')}",
+        f"RESUMEN: {p.get('descripcion')}",
+        f"DETALLES: {ficha}...",
+    ])
+
+def renderizar_inventario(propiedades):
+    # Orden estable por id para que el texto no cambie si la BD regresa otro orden
+    ordenadas = sorted(propiedades, key=lambda p: str(p.get('id', '')))
+    return "\n".join(renderizar_propiedad(p) for p in ordenadas) + "\n---"
+
+def renderizar_catalogo(propiedades):
+    """Una línea por propiedad: suficiente para la vitrina sin cargar fichas"""
+    ordenadas = sorted(propiedades, key=lambda p: str(p.get('id', '')))
+    lineas = [
+        f"{i}. [{clasificar_tipo(p.get('titulo'))}] {p.get('titulo')} | {p.get('ubicacion')} | {p.get('precio')}"
+        for i, p in enumerate(ordenadas, 1)
+    ]
+    return "CATÁLOGO (resumen):\n" + "\n".join(lineas)
+
+def inventario_completo(inventario):
+    return len(inventario['propiedades']) <= TOP_K
+
+def prefijo_estatico(agente, inventario):
+    """Personalidad + reglas + inventario (o catálogo); memoizado por agente y versión de inventario"""
+    clave = (agente.get('id'), agente.get('nombre'), inventario['version'])
+    if inventario_completo(inventario):
+        cuerpo = lambda: renderizar_inventario(inventario['propiedades'])
+    else:
+        cuerpo = lambda: renderizar_catalogo(inventario['propiedades'])
+    return cache_prompts.obtener(clave, lambda: PLANTILLA_PERSONA.format(nombre=agente.get('nombre')) + cuerpo())
+
+def construir_mensajes_sistema(agente, inventario, texto_agenda, ahora, consulta=""):
+    """Mensajes 'system' para OpenAI: primero el prefijo estable, luego lo volátil.
+    consulta es el texto reciente de la plática, para elegir las propiedades relevantes."""
+    volatil = ""
+    if not inventario_completo(inventario):
+        relevantes = propiedades_relevantes(agente.get('id'), inventario, consulta, TOP_K)
+        if relevantes:
+            volatil += "--- FICHAS RELEVANTES A ESTA PLÁTICA ---\n"
+            volatil += "\n".join(renderizar_propiedad(p) for p in relevantes) + "\n---\n"
+    volatil += (
+        "--- DATOS DE HOY ---\n"
+        f"HOY: {ahora.strftime('%A')}, {ahora.strftime('%Y-%m-%d')}\n"
+        f"AGENDA: {texto_agenda}"
+    )
+    return [
+        {"role": "system", "content": prefijo_estatico(agente, inventario)},
+        {"role": "system", "content": volatil},
+    ]
@@ -0,0 +1,136 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import Counter, deque
+from prompt_bot import clasificar_tipo
+from cache_respuestas import ETAPA_CITA, normalizar as normalizar_etapa
+from metricas import metricas
+
+# Atajo determinista antes del LLM: saludos, "¿qué tienes?", "me interesa la 2" y
+# "mándame la foto de la 2" se contestan directo del inventario cacheado, con el mismo estilo.
+# Todo lo demás (preguntas abiertas, citas) sigue yendo a OpenAI, y también cualquier mensaje
+# de una plática que ya está agendando (un "hola" ahí no debe regresar al cliente a la vitrina).
+
+EMOJI_TIPO = {"CASA": "🏡", "DEPARTAMENTO": "🏢", "TERRENO": "🌳", "PROPIEDAD": "🏠"}
+MAX_VITRINA = 10
+
+SALUDO = re.compile(r"^(hola+|buen[oa]s( dias| tardes| noches)?|que tal|hey|saludos)[\s!.,]*$")
+VITRINA = re.compile(r"^(hola[\s,!]*)?(que (tienes|opciones|propiedades|casas) ?(tienes|hay|disponibles)?|"
+                     r"(me )?(muestras|ensenas|pasas) (tu|el) (catalogo|inventario)|catalogo|inventario|"
+                     r"que hay disponible|busco (?P<tipo>casa|depa|departamento|terreno|propiedad))[\s?!.]*$")
+TIPO_BUSCADO = {"casa": "CASA", "depa": "DEPARTAMENTO", "departamento": "DEPARTAMENTO", "terreno": "TERRENO"}
+FOTO = re.compile(r"\b(foto|fotos|imagen|imagenes)\b.*\b(la|el|opcion|numero|#)\s*(?P<n>\d{1,2})\b")
+DETALLE = re.compile(r"^(me interesa|info(rmacion)?( de)?|detalles?( de)?|ver|a ver|quiero ver|cuentame de|y)?\s*"
+                     r"(la|el|opcion|numero|#)\s*(?P<n>\d{1,2})[\s?!.]*$")
+LINEA_LISTA = re.compile(r"^\s*(\d{1,2})[.)]\s*(.+)$", re.M)
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', (texto or '').lower().strip())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[¿¡]", "", re.sub(r"\s+", " ", texto))
+
+def ordenar(propiedades):
+    # Mismo orden que el catálogo de prompt_bot, así "la 2" significa lo mismo para ambos
+    return sorted(propiedades, key=lambda p: str(p.get('id', '')))
+
+def render_vitrina(propiedades, saludo=True):
+    ordenadas = ordenar(propiedades)
+    lineas = ["¡Hola! 👋 Tengo estas opciones increíbles para ti:" if saludo else "Tengo estas opciones para ti: ✨"]
+    for i, p in enumerate(ordenadas[:MAX_VITRINA], 1):
+        emoji = EMOJI_TIPO.get(clasificar_tipo(p.get('titulo')), "🏠")
+        lineas.append(f"{i}. {emoji} {p.get('titulo')} ({p.get('ubicacion')})")
+    if len(ordenadas) > MAX_VITRINA:
+        lineas.append(f"...y {len(ordenadas) - MAX_VITRINA} opciones más. Cuéntame qué zona o presupuesto buscas y te filtro las mejores 😉")
+    lineas.append("¿Cuál te llama la atención? 👀")
+    return "\n".join(lineas)
+
+CIERRE_DETALLE = "¿Te gustaría agendar una visita? 📅"
+
+def render_detalle(p):
+    return (f"✨ *{p.get('titulo')}*\n📍 {p.get('ubicacion')}\n\n{p.get('descripcion')}\n\n"
+            f"💰 Precio: {p.get('precio')}\n\n{CIERRE_DETALLE}")
+
+def en_etapa_cita(historial):
+    """La plática ya va en la cita (la misma señal que usa la cache de respuestas).
+    La pregunta fija del detalle no cuenta: ahí todavía se está viendo el catálogo."""
+    recientes = " ".join(normalizar_etapa(m['content'].replace(CIERRE_DETALLE, "")) for m in historial[-4:])
+    return bool(ETAPA_CITA.search(recientes))
+
+def propiedad_numero(n, propiedades, lista_bot):
+    """La propiedad 'n' según la última lista que mandó el bot; si no se puede saber con certeza, None"""
+    items = {int(num): texto for num, texto in LINEA_LISTA.findall(lista_bot or '')}
+    if n not in items: return None
+    linea = normalizar(items[n])
+    candidatas = [p for p in propiedades if p.get('titulo') and normalizar(p['titulo']) in linea]
+    # Si dos títulos caben en la misma línea, el más largo es el más específico
+    return max(candidatas, key=lambda p: len(p['titulo'])) if candidatas else None
+
+class RouterIntenciones:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.decisiones = Counter()
+        self.latencias = deque(maxlen=5000)  # ms de los turnos contestados sin LLM
+
+    def decidir(self, mensaje, historial, inventario):
+        """(intencion, texto, url_media) o None si el turno necesita al LLM"""
+        texto = normalizar(mensaje)
+        propiedades = inventario['propiedades']
+        if not propiedades or en_etapa_cita(historial): return None
+        # La última lista numerada que mandó el bot (la vitrina a la que se refiere "la 2")
+        lista_bot = next((m['content'] for m in reversed(historial)
+                              if m['role'] == 'assistant' and LINEA_LISTA.search(m['content'])), "")
+
+        if SALUDO.match(texto):
+            return "saludo", render_vitrina(propiedades), None
+        vitrina = VITRINA.match(texto)
+        if vitrina:
+            tipo = TIPO_BUSCADO.get(vitrina.group("tipo"))
+            if tipo:
+                propiedades = [p for p in propiedades if clasificar_tipo(p.get('titulo')) == tipo]
+                if not propiedades: return None  # no hay de ese tipo: que el LLM ofrezca alternativas
+            return "vitrina", render_vitrina(propiedades, saludo=texto.startswith("hola")), None
+
+        foto = FOTO.search(texto)
+        if foto:
+            p = propiedad_numero(int(foto.group("n")), propiedades, lista_bot)
+            if p and p.get('foto_url'):
+                return "foto", f"¡Claro! Aquí tienes la foto de *{p['titulo']}* 📸", p['foto_url']
+            return None
+        detalle = DETALLE.match(texto)
+        if detalle:
+            p = propiedad_numero(int(detalle.group("n")), propiedades, lista_bot)
+            if p:
+                return "detalle", render_detalle(p), p.get('foto_url') or None
+        return None
+
+    def registrar(self, intencion, ms=None):
+        with self._lock:
+            self.decisiones[intencion] += 1
+            if ms is not None: self.latencias.append(ms)
+        # Las decisiones por intención ya salen en /metrics (router_decisiones_total, vía estadisticas())
+        if ms is not None:
+            metricas.observar("router_atajo_segundos", ms / 1000, "Turnos contestados sin LLM", intencion=intencion)
+
+    def responder(self, mensaje, historial, inventario, inicio=None):
+        """Como decidir() pero registra la decisión; 'inicio' (perf_counter) para medir el turno completo"""
+        inicio = inicio or time.perf_counter()
+        decision = self.decidir(mensaje, historial, inventario)
+        if decision is None:
+            self.registrar("llm")
+            return None
+        self.registrar(decision[0], (time.perf_counter() - inicio) * 1000)
+        return decision
+
+    def estadisticas(self):
+        with self._lock:
+            total = sum(self.decisiones.values())
+            atajos = total - self.decisiones["llm"]
+            latencias = sorted(self.latencias)
+            return {
+                "turnos": total,
+                "sin_llm": atajos,
+                "fraccion_sin_llm": round(atajos / total, 4) if total else 0.0,
+                "p50_ms": round(latencias[len(latencias) // 2], 3) if latencias else None,
+                "por_intencion": dict(self.decisiones),
+            }
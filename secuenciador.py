@@ -0,0 +1,154 @@
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# Un turno a la vez por conversación, y ráfagas agrupadas:
+# la gente manda "hola" / "busco casa" / "en el norte" en tres mensajes seguidos.
+# El primer mensaje de la ráfaga abre un turno; los siguientes sólo se suman a 'pendientes'.
+# Quien atiende el turno espera a que la conversación se quede callada 'ventana' segundos,
+# junta todo y hace UNA sola llamada. Si el turno anterior sigue en proceso, espera: el historial queda en orden.
+#
+#   modo síncrono:  turno(clave, mensaje, procesar) -> respuesta, o None si la contesta otro request
+#   modo asíncrono: if recibir(clave, mensaje): encolar(...)  y el worker llama atender(clave, procesar)
+#
+# Con varios procesos (gunicorn) cada uno tiene su secuenciador; 'ruta_bloqueos' agrega un candado
+# de archivo por conversación para que dos workers no contesten la misma plática a la vez.
+# Un archivo por clave (no compartido): pláticas distintas nunca se esperan entre sí.
+
+class _Conversacion:
+    __slots__ = ("cond", "proceso", "pendientes", "recolectando", "primero", "ultimo", "activos")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.proceso = threading.Lock()   # serializa los turnos de esta conversación
+        self.pendientes = []
+        self.recolectando = False         # ya hay un turno abierto juntando la ráfaga
+        self.primero = 0.0
+        self.ultimo = 0.0
+        self.activos = 0                  # hilos dentro de atender()
+
+class Secuenciador:
+    def __init__(self, ventana=1.5, espera_maxima=4.0, separador="\n", ruta_bloqueos=None):
+        self.ventana = ventana                # silencio que cierra la ráfaga
+        self.espera_maxima = espera_maxima    # tope desde el primer mensaje (Twilio corta a los 15 s)
+        self.separador = separador
+        self.ruta_bloqueos = ruta_bloqueos    # carpeta compartida entre procesos (None = un solo proceso)
+        if ruta_bloqueos:
+            os.makedirs(ruta_bloqueos, exist_ok=True)
+        self._conversaciones = {}
+        self._lock = threading.Lock()
+        self.turnos = 0
+        self.agrupados = 0                    # mensajes que viajaron dentro del turno de otro
+
+    def _conversacion(self, clave):
+        """Llamar con self._lock tomado"""
+        c = self._conversaciones.get(clave)
+        if c is None:
+            c = self._conversaciones[clave] = _Conversacion()
+        return c
+
+    def _liberar(self, clave, c):
+        """Borra la conversación si ya no hay nada en curso (no crece con cada número que escribe)"""
+        with self._lock, c.cond:
+            if c.activos == 0 and not c.pendientes and not c.recolectando:
+                self._conversaciones.pop(clave, None)
+
+    def recibir(self, clave, mensaje):
+        """Suma el mensaje; True si abre un turno nuevo (hay que atenderlo), False si va en uno abierto"""
+        with self._lock:
+            c = self._conversacion(clave)
+            with c.cond:
+                ahora = time.monotonic()
+                c.pendientes.append(mensaje)
+                c.ultimo = ahora
+                if c.recolectando:
+                    c.cond.notify_all()  # quien atiende vuelve a esperar la ventana
+                    self.agrupados += 1
+                    return False
+                c.recolectando = True
+                c.primero = ahora
+                return True
+
+    def cancelar(self, clave):
+        """Tira el turno abierto (ej. la cola estaba llena y ya se le contestó al cliente)"""
+        with self._lock:
+            c = self._conversaciones.get(clave)
+            if c is None: return
+            with c.cond:
+                c.pendientes = []
+                c.recolectando = False
+                if c.activos == 0:
+                    self._conversaciones.pop(clave, None)
+
+    @contextmanager
+    def _bloqueo_entre_procesos(self, clave):
+        if not self.ruta_bloqueos:
+            yield
+            return
+        import fcntl  # sólo Unix, igual que gunicorn
+        ruta = os.path.join(self.ruta_bloqueos, hashlib.sha1(clave.encode()).hexdigest() + ".lock")
+        while True:
+            fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                vigente = os.fstat(fd).st_ino == os.stat(ruta).st_ino
+            except FileNotFoundError:
+                vigente = False
+            if vigente: break
+            os.close(fd)  # quien lo tenía lo borró mientras esperábamos: abrir el nuevo
+        try:
+            yield
+        finally:
+            # Se borra con el candado tomado (no se acumula un archivo por cada número que escribió)
+            os.unlink(ruta)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def atender(self, clave, procesar):
+        """procesar(texto) con toda la ráfaga junta, en orden respecto a los otros turnos de la conversación"""
+        with self._lock:
+            c = self._conversacion(clave)
+            with c.cond:
+                c.activos += 1
+        with c.cond:
+            # Esperamos silencio (o el tope); si el turno pasó tiempo en cola, normalmente ya no hay que esperar
+            while True:
+                restante = min(c.ultimo + self.ventana, c.primero + self.espera_maxima) - time.monotonic()
+                if restante <= 0: break
+                c.cond.wait(restante)
+        try:
+            with c.proceso, self._bloqueo_entre_procesos(clave):
+                with c.cond:
+                    # Lo que llegó mientras esperábamos el turno anterior también entra
+                    mensajes, c.pendientes = c.pendientes, []
+                    c.recolectando = False
+                if not mensajes: return None
+                with self._lock:
+                    self.turnos += 1
+                try:
+                    return procesar(self.separador.join(m for m in mensajes if m))
+                except Exception:
+                    # Que el reintento (o el siguiente turno) no pierda los mensajes
+                    with c.cond:
+                        c.pendientes[:0] = mensajes
+                    raise
+        finally:
+            with c.cond:
+                c.activos -= 1
+            self._liberar(clave, c)
+
+    def turno(self, clave, mensaje, procesar):
+        """Modo síncrono: recibir + atender en el mismo hilo; None si el mensaje lo contesta otro request"""
+        if not self.recibir(clave, mensaje): return None
+        return self.atender(clave, procesar)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "turnos": self.turnos,
+                "mensajes_agrupados": self.agrupados,
+                "conversaciones_activas": len(self._conversaciones),
+                "ventana_seg": self.ventana,
+            }